@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import abc, asyncio, concurrent.futures, threading
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def event_loop ():
+    # Event loop shared by every async engine, run by a single thread started on first use.
+    # Results go back to the window through the engine callbacks, which the window hands over
+    # to the GLib main loop.
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='pyneedle-async', daemon=True).start()
+        return _loop
+
+class AsyncEngine(abc.ABC):
+    # Base class of the engines written as coroutines (only the recoll one for now: tracker
+    # is driven by Gio callbacks, recoll_mp and recoll_sharded by worker processes and
+    # recoll_nt by the GLib main loop). Subclasses implement search() and page(), and this
+    # class provides the usual engine interface (do_search, fetch_page, cancel) reporting
+    # to results_ready_cb. Starting a search cancels the previous one at its next await,
+    # and nothing is reported for cancelled searches.
+    def __init__(self, result_limit, results_ready_cb=None, debug=True, loop=None):
+        self._result_limit = result_limit
+        self._results_ready_cb = results_ready_cb
+        self._debug = debug
+        self._loop = loop or event_loop()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._search_future = None
+        self._page_future = None
+        # Blocking calls of an engine run one at a time on its own thread
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def do_search (self, query_text, fts):
+        with self._lock:
+            self._generation += 1
+            self._cancel_futures()
+            self._search_future = asyncio.run_coroutine_threadsafe(self._run_search(self._generation, query_text, fts), self._loop)
+
+    def fetch_page (self, query_text, fts, offset, count):
+        with self._lock:
+            if self._page_future:
+                self._page_future.cancel()
+            self._page_future = asyncio.run_coroutine_threadsafe(self._run_page(self._generation, query_text, fts, offset, count), self._loop)
+
+    def cancel (self):
+        with self._lock:
+            self._generation += 1
+            self._cancel_futures()
+
+    def run_blocking (self, function, *args):
+        # Awaitable running a blocking call (e.g. of an indexer library) off the event loop
+        return self._loop.run_in_executor(self._executor, function, *args)
+
+    def _cancel_futures (self):
+        for future in (self._search_future, self._page_future):
+            if future:
+                future.cancel()
+        self._search_future = None
+        self._page_future = None
+
+    def _report (self, generation, *args, **kwargs):
+        # Searches superseded after their last await are not reported either
+        with self._lock:
+            if generation != self._generation:
+                return
+        self._results_ready_cb(*args, **kwargs)
+
+    async def _run_search (self, generation, query_text, fts):
+        rows = []
+        try:
+            async for batch, nres in self.search(query_text, fts):
+                rows.extend(batch)
+                if nres is None:
+                    self._report(generation, batch, None, partial=True)
+                else:
+                    self._report(generation, rows, nres)
+                    return
+        except asyncio.CancelledError:
+            if self._debug: print(self.name, "search cancelled:", query_text)
+            raise
+        except Exception as e:
+            print(self.name, "search failed:", e)
+
+    async def _run_page (self, generation, query_text, fts, offset, count):
+        try:
+            rows, nres = await self.page(query_text, fts, offset, count)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(self.name, "page failed:", e)
+            return
+        self._report(generation, rows, nres, offset=offset)
+
+    @abc.abstractmethod
+    def search (self, query_text, fts):
+        # Async generator yielding (rows, nres) pairs, nres being None for the batches
+        # streamed before the last one, which carries the total count (and may have no rows)
+        pass
+
+    @abc.abstractmethod
+    async def page (self, query_text, fts, offset, count):
+        # Returns the (rows, nres) of a page
+        pass
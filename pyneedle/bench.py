@@ -0,0 +1,264 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Headless benchmark: replays typing traces through the same engines and layers used by
+# the window and reports the latencies seen by the user as JSON. The engines run on fake
+# tracker and recoll backends searching a synthetic corpus (see bench_backends), so that
+# it runs without any indexer installed.
+#
+from .bench_backends import MainLoop, synthetic_corpus, install, recoll_worker
+from .federated_engine import FederatedEngine
+from .refine import QueryRefiner
+from .result_cache import ResultCache, CachingEngine
+from .scheduler import SearchScheduler
+from .tracing import stats, tracer
+import argparse, functools, json, random, sys, tempfile, threading, time
+
+_QUERIES = ['report 2013', 'invoice pdf', 'holiday photo', 'draft thesis', 'meeting notes', 'budget ods',
+            'contract final', 'slides review', 'backup tar', 'summary june']
+
+def synthetic_trace (queries=_QUERIES, interval=0.12, jitter=0.5, pause=1.5, seed=0):
+    # Keystrokes as (delay since the previous one, entry text): each query is typed
+    # character by character and followed by a pause, as when reading the results
+    rnd = random.Random(seed)
+    trace = []
+    for query in queries:
+        for i in range(1, len(query) + 1):
+            delay = pause if i == 1 and trace else interval * (1 + jitter * (2 * rnd.random() - 1))
+            trace.append((delay, query[:i]))
+    return trace
+
+def load_trace (path):
+    # Recorded traces are JSON lists of [delay in seconds, entry text]
+    with open(path) as f:
+        return [(float(delay), text) for delay, text in json.load(f)]
+
+class _Probe:
+    # Wraps the benchmarked engine to time the searches really sent to it
+    def __init__(self, engine_factory, results_ready_cb):
+        self._results_ready_cb = results_ready_cb
+        self._engine = engine_factory(self._engine_results_ready)
+        self._lock = threading.Lock()
+        self._started = None
+        self.name = self._engine.name
+        self.searches = 0
+        self.wasted = 0
+        self.latencies = []
+
+    def index_version (self):
+        return self._engine.index_version()
+
+    def do_search (self, query_text, fts):
+        with self._lock:
+            if self._started is not None:
+                self.wasted += 1
+            self._started = time.time()
+            self.searches += 1
+        self._engine.do_search(query_text, fts)
+
+    def fetch_page (self, query_text, fts, offset, count):
+        self._engine.fetch_page(query_text, fts, offset, count)
+
+    def cancel (self):
+        with self._lock:
+            if self._started is not None:
+                self.wasted += 1
+            self._started = None
+        self._engine.cancel()
+
+    def close (self):
+        self.cancel()
+        close = getattr(self._engine, 'close', None)
+        if close:
+            close()
+
+    def reset (self):
+        with self._lock:
+            self.searches = 0
+            self.wasted = 0
+            self.latencies = []
+
+    def _engine_results_ready (self, result, nres, partial=False, offset=None):
+        if offset is None and not partial:
+            with self._lock:
+                if self._started is not None:
+                    self.latencies.append(time.time() - self._started)
+                self._started = None
+        self._results_ready_cb(result, nres, partial=partial, offset=offset)
+
+def replay (engine_factory, trace, loop, fts=False, result_limit=20, layers=True, settle=3.0, debug=False):
+    # Types the trace into the engine (wrapped in the window layers unless layers is False)
+    # and times the results of every keystroke as the window would show them: results are
+    # attributed to the last keystroke, earlier keystrokes are superseded. Engine calls are
+    # made from the main loop, as in the window.
+    lock = threading.Lock()
+    keystrokes = []
+    done = threading.Event()
+    warmed_up = threading.Event()
+
+    def results_ready (result, nres, partial=False, offset=None):
+        if offset is not None:
+            return
+        now = time.time()
+        with lock:
+            if not keystrokes:
+                if not partial:
+                    warmed_up.set()
+                return
+            keystroke = keystrokes[-1]
+            if keystroke['first'] is None:
+                keystroke['first'] = now
+            if not partial and keystroke['final'] is None:
+                keystroke['final'] = now
+                if keystroke['last']:
+                    done.set()
+
+    probe = None
+    def probe_factory (cb):
+        nonlocal probe
+        probe = _Probe(engine_factory, cb)
+        return probe
+
+    if layers:
+        refiner_factory = lambda cb: QueryRefiner(probe_factory, cb, debug)
+        cache_factory = lambda cb: CachingEngine(refiner_factory, ResultCache(), result_limit, cb, debug)
+        engine = loop.invoke(lambda: SearchScheduler(cache_factory, results_ready, debug, timeout_add=loop.timeout_add,
+                                                     source_remove=loop.source_remove))
+    else:
+        engine = loop.invoke(probe_factory, results_ready)
+
+    # A first search waits for the engine to be ready (e.g. its worker processes started)
+    loop.idle_add(engine.do_search, 'pyneedle-bench-warm-up', fts)
+    warmed_up.wait(120)
+    probe.reset()
+    tracer.clear()
+
+    # Keystrokes are sent at their absolute times so that slow do_search calls do not shift the trace
+    starttime = time.time()
+    due = starttime
+    for i, (delay, text) in enumerate(trace):
+        due += delay
+        time.sleep(max(0, due - time.time()))
+        with lock:
+            keystrokes.append({'sent': time.time(), 'first': None, 'final': None, 'last': i == len(trace) - 1})
+        tracer.new_query()
+        loop.idle_add(engine.do_search, text, fts)
+
+    done.wait(settle)
+    duration = time.time() - starttime
+    loop.invoke(engine.close)
+
+    with lock:
+        first = [k['first'] - k['sent'] for k in keystrokes if k['first'] is not None]
+        final = [k['final'] - k['sent'] for k in keystrokes if k['final'] is not None]
+        return {
+            'engine': probe.name,
+            'keystrokes': len(keystrokes),
+            'engine_searches': probe.searches,
+            'wasted_searches': probe.wasted,
+            'unanswered_keystrokes': len(keystrokes) - len(first),
+            'time_to_first_result': stats(first),
+            'time_to_final_result': stats(final),
+            'engine_latency': stats(probe.latencies),
+            'spans': tracer.stats(),
+            'duration': duration,
+        }
+
+def engine_factories (args, loop):
+    # The engines of the window, on the fake backends (but the native one, on real folders)
+    recoll_engine, tracker_engine = install(synthetic_corpus(args.files, args.seed), loop, args.tracker_latency,
+                                            args.recoll_latency, args.seed)
+    # Worker processes build the same corpus and fake recoll
+    worker = functools.partial(recoll_worker, args.files, args.seed, args.recoll_latency)
+    factories = {}
+    factories['tracker'] = lambda cb: tracker_engine.TrackerEngine(args.result_limit, cb, args.debug, count_limit=args.count_limit)
+    factories['recoll'] = lambda cb: recoll_engine.RecollEngineSP(args.result_limit, cb, args.debug, count_limit=args.count_limit)
+    factories['recoll_mp'] = lambda cb: recoll_engine.RecollEngineMP(args.result_limit, cb, args.debug, count_limit=args.count_limit,
+                                                                     worker=worker)
+    factories['recoll_nt'] = lambda cb: recoll_engine.RecollEngineNT(args.result_limit, cb, args.debug, count_limit=args.count_limit)
+    factories['recoll_sharded'] = lambda cb: recoll_engine.RecollEngineSharded(args.result_limit, cb, args.debug,
+                                                                               count_limit=args.count_limit, worker=worker,
+                                                                               confdirs=['fake:%d/%d' % (i, args.shards) for i in range(args.shards)])
+    factories['federated'] = lambda cb: FederatedEngine(args.result_limit, cb, args.debug,
+                                                        engine_factories=[factories['tracker'], factories['recoll_mp']],
+                                                        timeout_add=loop.timeout_add, source_remove=loop.source_remove)
+    if args.native_roots:
+        from . import native_engine
+        index_path = tempfile.mkdtemp(prefix='pyneedle-bench-') + '/native.idx'
+        # The replayed engines load the index built by _wait_native_index and never crawl
+        # again, a rescan finishing during the trace would invalidate the cache and refiner
+        factories['native'] = lambda cb: native_engine.NativeEngine(args.result_limit, cb, args.debug, roots=args.native_roots,
+                                                                    index_path=index_path, count_limit=args.count_limit,
+                                                                    rescan_interval=0)
+        factories['native_build'] = lambda cb: native_engine.NativeEngine(args.result_limit, cb, args.debug, roots=args.native_roots,
+                                                                          index_path=index_path)
+    return factories
+
+def _wait_native_index (factory, timeout=600):
+    # Builds the native index once so that the replay does not time the crawl
+    engine = factory(lambda result, nres, partial=False, offset=None: None)
+    return engine.wait_index(timeout)
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay typing traces through the search engines and report latencies as JSON')
+    parser.add_argument('--engines', dest='engines', metavar='LIST', default='tracker,recoll,recoll_mp,federated',
+                        help='comma separated engines (tracker, recoll, recoll_nt, recoll_mp, recoll_sharded, federated, native)')
+    parser.add_argument('--files', dest='files', metavar='N', type=int, default=200000, help='files in the synthetic corpus')
+    parser.add_argument('--trace', dest='trace', metavar='FILE', help='recorded trace (JSON list of [delay, text])')
+    parser.add_argument('--interval', dest='interval', metavar='SECONDS', type=float, default=0.12, help='keystroke interval of the synthetic trace')
+    parser.add_argument('--tracker-latency', dest='tracker_latency', metavar='SECONDS', type=float, default=0.08, help='latency of the fake tracker backend')
+    parser.add_argument('--recoll-latency', dest='recoll_latency', metavar='SECONDS', type=float, default=0.15, help='latency of the fake recoll backend')
+    parser.add_argument('--shards', dest='shards', metavar='N', type=int, default=3, help='shards of the recoll_sharded engine')
+    parser.add_argument('--native-root', dest='native_roots', metavar='DIR', action='append', help='folder indexed by the native engine (can be repeated)')
+    parser.add_argument('--limit', dest='result_limit', metavar='N', type=int, default=20, help='maximum number of results')
+    parser.add_argument('--count-limit', dest='count_limit', metavar='N', type=int, default=1000, help='stop counting results after N matches (0 for exact counts)')
+    parser.add_argument('--no-layers', dest='layers', action='store_false', help='send every keystroke to the engine (no scheduler, cache nor refiner)')
+    parser.add_argument('--fts', dest='fts', action='store_true', help='send the queries as full text searches')
+    parser.add_argument('--seed', dest='seed', metavar='N', type=int, default=0, help='seed of the synthetic corpus and trace')
+    parser.add_argument('--output', dest='output', metavar='FILE', help='write the report to FILE instead of the standard output')
+    parser.add_argument('--debug', dest='debug', action='store_true', help='enable debugging')
+    args = parser.parse_args()
+
+    tracer.configure(True, args.debug)
+    trace = load_trace(args.trace) if args.trace else synthetic_trace(interval=args.interval, seed=args.seed)
+    loop = MainLoop()
+    factories = engine_factories(args, loop)
+
+    report = {'files': args.files, 'keystrokes': len(trace), 'layers': args.layers, 'fts': args.fts, 'engines': {}}
+    for name in args.engines.split(','):
+        if name not in factories or name == 'native_build':
+            parser.error('unknown engine ' + name + (' (native needs --native-root)' if name == 'native' else ''))
+        if name == 'native' and not _wait_native_index(factories['native_build']):
+            parser.error('cannot build the native index')
+        report['engines'][name] = replay(factories[name], trace, loop, args.fts, args.result_limit, args.layers, debug=args.debug)
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    json.dump(report, output, indent=2)
+    output.write('\n')
+    if args.output:
+        output.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Fake backends for the benchmark: a main loop standing in for GLib's, and the Tracker
+# (SPARQL connection, statements and cursors) and recoll (connect, queries and fetchmany)
+# APIs answering from a synthetic corpus after a given latency. The real engine classes
+# run on top of them, so that the benchmark times their code and not a stand-in.
+#
+from .hit import Hit
+import heapq, random, re, sys, threading, time, types, urllib.parse
+
+_WORDS = ['report', 'invoice', 'photo', 'holiday', 'draft', 'notes', 'budget', 'thesis', 'paper', 'slides',
+          'meeting', 'contract', 'backup', 'project', 'summary', 'letter', 'scan', 'music', 'video', 'config',
+          'server', 'client', 'test', 'final', 'review', 'plan', 'data', 'results', 'old', 'new', 'copy',
+          'january', 'march', 'june', 'october', '2011', '2012', '2013', 'alex', 'pedro', 'um', 'es']
+
+_TYPES = [('pdf', 'application/pdf'), ('txt', 'text/plain'), ('odt', 'application/vnd.oasis.opendocument.text'),
+          ('jpg', 'image/jpeg'), ('png', 'image/png'), ('mp3', 'audio/mpeg'), ('py', 'text/x-python'),
+          ('tar.gz', 'application/x-compressed-tar'), ('html', 'text/html'), ('ods', 'application/vnd.oasis.opendocument.spreadsheet')]
+
+def synthetic_corpus (nfiles, seed=0):
+    # Hits as the engines return them (url, name, size, mtime, mimetype), newest first
+    rnd = random.Random(seed)
+    now = time.time()
+    corpus = []
+    for i in range(nfiles):
+        folder = '/home/user/' + '/'.join(rnd.choice(_WORDS) for depth in range(rnd.randint(1, 3)))
+        ext, mimetype = rnd.choice(_TYPES)
+        name = '%s_%s%d.%s' % (rnd.choice(_WORDS), rnd.choice(_WORDS), i, ext)
+        mtime = int(now - rnd.random() * 3 * 365 * 86400)
+        corpus.append(Hit('file://' + urllib.parse.quote(folder + '/' + name), name, rnd.randint(0, 1 << 24), mtime, mimetype))
+    corpus.sort(key=lambda hit: hit.mtime, reverse=True)
+    return corpus
+
+class MainLoop:
+    # GLib.timeout_add/idle_add/source_remove replacement: callbacks run one at a time on a
+    # thread of their own, as they would in the window main loop
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._queue = []
+        self._removed = set()
+        self._next_tag = 0
+        threading.Thread(target=self._run, name='bench-main-loop', daemon=True).start()
+
+    def timeout_add (self, interval, function, *args):
+        with self._condition:
+            self._next_tag += 1
+            heapq.heappush(self._queue, (time.time() + interval / 1000.0, self._next_tag, function, args))
+            self._condition.notify()
+            return self._next_tag
+
+    def idle_add (self, function, *args):
+        return self.timeout_add(0, function, *args)
+
+    def source_remove (self, tag):
+        with self._condition:
+            self._removed.add(tag)
+
+    def invoke (self, function, *args):
+        # Runs the function in the loop and waits for it
+        done = threading.Event()
+        result = []
+
+        def run ():
+            try:
+                result.append(function(*args))
+            finally:
+                done.set()
+        self.idle_add(run)
+        done.wait()
+        return result[0] if result else None
+
+    def _run (self):
+        while True:
+            with self._condition:
+                while not self._queue or self._queue[0][0] > time.time():
+                    self._condition.wait(self._queue[0][0] - time.time() if self._queue else None)
+                due, tag, function, args = heapq.heappop(self._queue)
+                if tag in self._removed:
+                    self._removed.discard(tag)
+                    continue
+            try:
+                repeat = function(*args)
+            except Exception as e:
+                print("Main loop callback failed:", e, file=sys.stderr)
+                continue
+            # Sources returning True run again, as in GLib (only timeouts of 0 are used here)
+            if repeat:
+                with self._condition:
+                    heapq.heappush(self._queue, (time.time(), tag, function, args))
+
+class _Matcher:
+    # Filename (and, as a stand-in, full text) matching on the corpus after the latency of
+    # the backend
+    def __init__(self, corpus, latency, jitter=0.2, seed=0):
+        self.corpus = corpus
+        self._lower_names = [hit.name.lower() for hit in corpus]
+        self._latency = latency
+        self._jitter = jitter
+        self._random = random.Random(seed)
+
+    def shard (self, index, count):
+        return _Matcher(self.corpus[index::count], self._latency, self._jitter, index)
+
+    def wait (self):
+        time.sleep(self._latency * (1 + self._jitter * (2 * self._random.random() - 1)))
+
+    def match (self, words, dirs=()):
+        # Indices of the matching hits, newest first
+        prefixes = ['file://' + urllib.parse.quote(directory.rstrip('/') + '/') for directory in dirs]
+        return [i for i, name in enumerate(self._lower_names) if all(word in name for word in words) and
+                (not prefixes or any(self.corpus[i].url.startswith(prefix) for prefix in prefixes))]
+
+##############################
+# Tracker
+##############################
+
+# Domain and code of the GLib errors of cancelled operations
+_IO_ERROR = 'g-io-error-quark'
+_CANCELLED = 19
+
+class _GError(Exception):
+    def __init__(self, message, domain, code):
+        Exception.__init__(self, message)
+        self.domain = domain
+        self.code = code
+
+    def matches (self, domain, code):
+        return self.domain == domain and self.code == code
+
+def _cancelled_error ():
+    return _GError('Operation was cancelled', _IO_ERROR, _CANCELLED)
+
+class _Cancellable:
+    def __init__(self):
+        self._cancelled = False
+
+    def cancel (self):
+        self._cancelled = True
+
+    def is_cancelled (self):
+        return self._cancelled
+
+class _Notifier:
+    def connect (self, signal, callback):
+        pass
+
+class _Cursor:
+    def __init__(self, rows, loop):
+        self._rows = rows
+        self._loop = loop
+        self._position = -1
+
+    def next (self, cancellable):
+        self._position += 1
+        return self._position < len(self._rows)
+
+    def next_async (self, cancellable, callback, user_data):
+        # The result is the exception to raise from next_finish when cancelled
+        result = _cancelled_error() if cancellable and cancellable.is_cancelled() else self.next(None)
+        self._loop.idle_add(callback, self, result, user_data)
+
+    def next_finish (self, result):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def get_string (self, column):
+        value = str(self._rows[self._position][column])
+        return value, len(value)
+
+    def get_integer (self, column):
+        return int(self._rows[self._position][column])
+
+class _Statement:
+    def __init__(self, query, matcher, loop):
+        self._query = query
+        self._matcher = matcher
+        self._loop = loop
+        self._bindings = {}
+
+    def bind_string (self, name, value):
+        self._bindings[name] = value
+
+    def bind_int (self, name, value):
+        self._bindings[name] = value
+
+    def execute (self, cancellable):
+        self._matcher.wait()
+        return _Cursor(self._evaluate(dict(self._bindings)), self._loop)
+
+    def execute_async (self, cancellable, callback, user_data):
+        # Queries run out of the main loop (in the tracker daemon), the bindings are read now
+        bindings = dict(self._bindings)
+
+        def run ():
+            self._matcher.wait()
+            if cancellable and cancellable.is_cancelled():
+                result = _cancelled_error()
+            else:
+                result = _Cursor(self._evaluate(bindings), self._loop)
+            self._loop.idle_add(callback, self, result, user_data)
+        threading.Thread(target=run, daemon=True).start()
+
+    def execute_finish (self, result):
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _evaluate (self, bindings):
+        terms = []
+        while 't' + str(len(terms)) in bindings:
+            terms.append(bindings['t' + str(len(terms))])
+        dirs = []
+        while 'd' + str(len(dirs)) in bindings:
+            dirs.append(urllib.parse.unquote(bindings['d' + str(len(dirs))][len('file://'):]))
+        if 'fts:match' in self._query:
+            terms = [word.lower() for word in terms[0].split(' ') if word]
+        matches = self._matcher.match(terms, dirs)
+
+        if 'count(' in self._query:
+            nres = len(matches)
+            if '~countlimit' in self._query:
+                nres = min(nres, bindings['countlimit'])
+            return [[nres]]
+
+        offset = bindings.get('offset', 0)
+        rows = []
+        for i in matches[offset:offset + bindings['limit']]:
+            hit = self._matcher.corpus[i]
+            rows.append([hit.url, hit.name, hit.size, time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(hit.mtime)), hit.mimetype])
+        return rows
+
+class _SparqlConnection:
+    def __init__(self, matcher, loop):
+        self._matcher = matcher
+        self._loop = loop
+
+    def query_statement (self, query, cancellable):
+        return _Statement(query, self._matcher, self._loop)
+
+    def create_notifier (self):
+        return _Notifier()
+
+class _File:
+    def __init__(self, path):
+        self._path = path
+
+    @classmethod
+    def new_for_path (cls, path):
+        return cls(path)
+
+    def get_uri (self):
+        # GIO leaves the reserved characters of RFC 3986 unescaped
+        return 'file://' + urllib.parse.quote(self._path, safe="/!$&'()*+,;=:@~")
+
+def fake_tracker (matcher, loop):
+    # Stand-ins of the Gio, GLib and Tracker modules used by the tracker engine
+    connection = _SparqlConnection(matcher, loop)
+    gio = types.SimpleNamespace(Cancellable=_Cancellable, File=_File, io_error_quark=lambda: _IO_ERROR,
+                                IOErrorEnum=types.SimpleNamespace(CANCELLED=_CANCELLED))
+    glib = types.SimpleNamespace(Error=_GError)
+    tracker = types.SimpleNamespace(SparqlConnection=types.SimpleNamespace(get_direct=lambda cancellable: connection))
+    return gio, glib, tracker
+
+##############################
+# Recoll
+##############################
+
+class _SearchData:
+    def __init__(self, type='and'):
+        self.clauses = []
+
+    def addclause (self, type, qstring=None, subSearch=None):
+        self.clauses.append((type, qstring, subSearch))
+
+    def terms (self):
+        # Words of the filename clauses and folders of the path clauses (and OR subsearches)
+        words = []
+        dirs = []
+        for type, qstring, sub in self.clauses:
+            if type == 'filename':
+                words.append(qstring.lower())
+            elif type == 'path':
+                dirs.append(qstring)
+            elif type == 'sub':
+                dirs.extend(sub.terms()[1])
+        return words, dirs
+
+class _RecollQuery:
+    def __init__(self, matcher):
+        self._matcher = matcher
+        self._matches = []
+        self._position = 0
+
+    def sortby (self, field, ascending=True):
+        # The corpus is already newest first
+        pass
+
+    def execute (self, query, stemlang=None):
+        dirs = re.findall(r'dir:"([^"]*)"', query)
+        text = re.sub(r'\(?dir:"[^"]*"\)?|\bOR\b', ' ', query)
+        return self._run([word.lower() for word in text.split(' ') if word], dirs)
+
+    def executesd (self, search_data):
+        return self._run(*search_data.terms())
+
+    def _run (self, words, dirs):
+        self._matcher.wait()
+        self._matches = self._matcher.match(words, dirs)
+        self._position = 0
+        return len(self._matches)
+
+    def scroll (self, offset, mode='relative'):
+        self._position = offset if mode == 'absolute' else self._position + offset
+
+    def fetchmany (self, count):
+        docs = []
+        for i in self._matches[self._position:self._position + count]:
+            hit = self._matcher.corpus[i]
+            docs.append(types.SimpleNamespace(url=hit.url, filename=hit.name, pcbytes=str(hit.size), fmtime=str(int(hit.mtime)),
+                                              dmtime='', mtype=hit.mimetype))
+        self._position += len(docs)
+        return docs
+
+class _RecollDb:
+    def __init__(self, matcher):
+        self._matcher = matcher
+
+    def query (self):
+        return _RecollQuery(self._matcher)
+
+def fake_recoll (matcher):
+    # Stand-in of the recoll module: confdirs 'fake:I/N' connect to the shard I of N of the corpus
+    def connect (confdir=None):
+        if confdir and confdir.startswith('fake:'):
+            index, count = confdir[len('fake:'):].split('/')
+            return _RecollDb(matcher.shard(int(index), int(count)))
+        return _RecollDb(matcher)
+    return types.SimpleNamespace(connect=connect, SearchData=_SearchData)
+
+##############################
+# Installation
+##############################
+
+def _import_engines ():
+    # The engine modules import the backend libraries, which do not need to be installed:
+    # the missing ones are replaced by empty modules before, and by the fakes after
+    for name in ('gi.repository.Gio', 'gi.repository.GLib', 'gi.repository.Tracker', 'recoll.recoll'):
+        package, module = name.rsplit('.', 1)
+        try:
+            __import__(package, fromlist=[module])
+            getattr(sys.modules[package], module)
+        except (ImportError, AttributeError, ValueError):
+            for i, part in enumerate(name.split('.')):
+                prefix = '.'.join(name.split('.')[:i + 1])
+                if prefix not in sys.modules:
+                    sys.modules[prefix] = types.ModuleType(prefix)
+                if i:
+                    setattr(sys.modules['.'.join(name.split('.')[:i])], part, sys.modules[prefix])
+
+    from . import recoll_engine, tracker_engine
+    return recoll_engine, tracker_engine
+
+def install (corpus, loop, tracker_latency, recoll_latency, seed=0):
+    # Points the engine modules to the fake backends, returns them
+    recoll_engine, tracker_engine = _import_engines()
+    tracker_engine.Gio, tracker_engine.GLib, tracker_engine.Tracker = fake_tracker(_Matcher(corpus, tracker_latency, seed=seed), loop)
+    recoll_engine.recoll = fake_recoll(_Matcher(corpus, recoll_latency, seed=seed))
+    recoll_engine.GLib = loop
+    return recoll_engine, tracker_engine
+
+def recoll_worker (nfiles, seed, latency, conn, result_limit, debug, count_limit, confdir):
+    # Target of the recoll_mp and sharded worker processes, built on the same corpus
+    recoll_engine, tracker_engine = _import_engines()
+    recoll_engine.recoll = fake_recoll(_Matcher(synthetic_corpus(nfiles, seed), latency, seed=seed))
+    recoll_engine._search_worker(conn, result_limit, debug, count_limit, confdir)
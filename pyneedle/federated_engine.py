@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import threading, time
+
+class _Backend:
+    def __init__(self, engine):
+        self.engine = engine
+        # Generation of the search the backend is working on (None when done)
+        self.generation = None
+        self.started = 0
+        self.result = None
+        self.nres = 0
+        # Exponentially weighted average of the backend latency
+        self.latency = None
+
+
+class FederatedEngine:
+    # Runs every search on several engines at the same time and merges their hits by
+    # modification time, without duplicated URLs. The hits of the first engine answering
+    # are shown at once (as a partial result), and the merged result is final when every
+    # engine answered or timed out. Engines much slower than the fastest one are not
+    # waited for: their hits are only merged when they arrive in time. A single main loop
+    # timeout per search stops waiting for the backends that did not answer.
+    def __init__(self, result_limit, results_ready_cb=None, debug=True, engine_factories=(), timeout=2.0,
+                 slow_factor=4.0, timeout_add=None, source_remove=None):
+        self._result_limit = result_limit
+        self._results_ready_cb = results_ready_cb
+        self._debug = debug
+        self._timeout = timeout
+        self._slow_factor = slow_factor
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._shown = False
+        self._backends = []
+        # Backends of the final result with the number of their hits in the merged hits
+        # shown, the URLs shown, their count, and the page being read
+        self._cursors = None
+        self._seen = set()
+        self._page_end = 0
+        self._page = None
+
+        if timeout_add is None:
+            from gi.repository import GLib
+            timeout_add, source_remove = GLib.timeout_add, GLib.source_remove
+        self._timeout_add = timeout_add
+        self._source_remove = source_remove
+        self._tag = None
+
+        for factory in engine_factories:
+            backend = _Backend(None)
+            backend.engine = factory(self._make_callback(backend))
+            self._backends.append(backend)
+        self.name = 'Federated (' + ' + '.join(backend.engine.name for backend in self._backends) + ')'
+
+    def _make_callback (self, backend):
+        return lambda result, nres, partial=False, offset=None: self._backend_ready(backend, result, nres, partial, offset)
+
+    def index_version (self):
+        return tuple(backend.engine.index_version() for backend in self._backends)
+
+    def do_search (self, query_text, fts):
+        with self._lock:
+            self._generation += 1
+            self._shown = False
+            self._cursors = None
+            self._page = None
+            starttime = time.time()
+            for backend in self._backends:
+                backend.generation = self._generation
+                backend.started = starttime
+                backend.result = None
+                backend.nres = 0
+            self._remove_timeout()
+            self._tag = self._timeout_add(int(self._timeout * 1000), self._on_timeout, self._generation)
+
+        for backend in self._backends:
+            backend.engine.do_search(query_text, fts)
+
+    def fetch_page (self, query_text, fts, offset, count):
+        # Every backend of the final result continues from its own position, and their pages
+        # are merged as the first hits were
+        with self._lock:
+            if self._cursors is not None and offset == self._page_end:
+                starts, skip, seen = self._cursors, 0, self._seen
+            else:
+                # Unknown position, the backends are merged again from their first hit
+                starts, skip, seen = dict.fromkeys(self._cursors or (), 0), offset, set()
+            # Backends without more hits are not asked
+            backends = [backend for backend in starts if starts[backend] < backend.nres]
+            self._page = (offset, count, skip, starts, seen, backends, {}) if backends else None
+
+        if not backends:
+            self._results_ready_cb([], None, offset=offset)
+            return
+        for backend in backends:
+            backend.engine.fetch_page(query_text, fts, starts[backend], skip + count)
+
+    def cancel (self):
+        with self._lock:
+            self._generation += 1
+            self._remove_timeout()
+            for backend in self._backends:
+                backend.generation = None
+        for backend in self._backends:
+            backend.engine.cancel()
+
+    def close (self):
+        self.cancel()
+        for backend in self._backends:
+            close = getattr(backend.engine, 'close', None)
+            if close:
+                close()
+
+    def latencies (self):
+        return dict((backend.engine.name, backend.latency) for backend in self._backends)
+
+    def _remove_timeout (self):
+        if self._tag is not None:
+            self._source_remove(self._tag)
+            self._tag = None
+
+    def _merge (self, answers, starts, skip, count, seen):
+        # Hits of the backends newest first without repeated URLs, where every backend
+        # continues after them, and the URLs shown
+        tagged = sorted(((hit, backend) for backend, rows in answers for hit in rows), key=lambda item: item[0].mtime, reverse=True)
+        cursors = dict(starts)
+        seen = set(seen)
+        hits = []
+        for hit, backend in tagged:
+            if len(hits) == skip + count:
+                break
+            cursors[backend] = cursors.get(backend, 0) + 1
+            if hit.url not in seen:
+                seen.add(hit.url)
+                hits.append(hit)
+        return hits[skip:], cursors, seen
+
+    def _page_ready (self, backend, result, nres):
+        with self._lock:
+            if self._page is None or backend not in self._page[5]:
+                return
+            offset, count, skip, starts, seen, backends, answers = self._page
+            answers[backend] = (result, nres)
+            if len(answers) < len(backends):
+                return
+            self._page = None
+            hits, self._cursors, self._seen = self._merge([(b, answer[0]) for b, answer in answers.items()], starts, skip, count, seen)
+            self._page_end = offset + len(hits)
+            nres = max([answer[1] for answer in answers.values() if answer[1] is not None] + [self._page_end])
+        self._results_ready_cb(hits, nres, offset=offset)
+
+    def _backend_ready (self, backend, result, nres, partial, offset):
+        if offset is not None:
+            self._page_ready(backend, result, nres)
+            return
+
+        # Backends are merged on their final results only
+        if partial:
+            return
+
+        with self._lock:
+            if backend.generation is None:
+                return
+
+            # Late answers still tell how slow the backend is
+            latency = time.time() - backend.started
+            backend.latency = latency if backend.latency is None else 0.7 * backend.latency + 0.3 * latency
+            if self._debug: print(backend.engine.name, "answered in", latency)
+
+            if backend.generation != self._generation:
+                if self._debug: print("Dropping late results from", backend.engine.name)
+                backend.generation = None
+                return
+            backend.generation = None
+            backend.result = result
+            backend.nres = nres
+            answer = self._answer()
+
+        self._send(answer)
+
+    def _on_timeout (self, generation):
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._tag = None
+            late = [backend for backend in self._backends if backend.generation == generation]
+            for backend in late:
+                if self._debug: print(backend.engine.name, "timed out")
+                # Timeouts count as a slow answer for the latency average
+                backend.latency = self._timeout if backend.latency is None else max(backend.latency, self._timeout)
+                backend.generation = None
+            answer = self._answer() if late else None
+
+        self._send(answer)
+        return False
+
+    def _is_slow (self, backend):
+        latencies = [b.latency for b in self._backends if b.latency is not None]
+        return backend.latency is not None and backend.latency > self._slow_factor * min(latencies)
+
+    def _answer (self):
+        # Returns the (result, nres, partial) to be sent after a backend answered, or None
+        answered = [backend for backend in self._backends if backend.result is not None]
+        waiting = [backend for backend in self._backends if backend.generation is not None and not self._is_slow(backend)]
+
+        if waiting and self._shown:
+            return None
+        self._shown = True
+
+        merged, cursors, seen = self._merge([(backend, backend.result) for backend in answered], {}, 0, self._result_limit, ())
+        nres = max([backend.nres for backend in answered] + [len(merged)])
+
+        if waiting:
+            return merged, None, True
+
+        # Slow backends still running are not waited for anymore, the next pages come from
+        # the backends of this result
+        self._generation += 1
+        self._remove_timeout()
+        self._cursors = dict((backend, cursors.get(backend, 0)) for backend in answered)
+        self._seen = seen
+        self._page_end = len(merged)
+        return merged, nres, False
+
+    def _send (self, answer):
+        if answer is None:
+            return
+        result, nres, partial = answer
+        if partial:
+            self._results_ready_cb(result, nres, partial=True)
+        else:
+            self._results_ready_cb(result, nres)
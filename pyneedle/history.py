@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+from .hit import Hit, apply_changes
+from .layer import EngineLayer
+from .refine import query_words
+from .scope import split_scope, in_scope
+import json, os, re, threading, time, urllib.parse
+
+# Longest name prefix kept in the index, longer words are checked against the names
+MAX_PREFIX = 8
+
+def default_history_path ():
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_dir, 'pyneedle', 'history.json')
+
+def _tokens (lower_name):
+    return [token for token in re.split(r'[^0-9a-z]+', lower_name) if token]
+
+class LaunchHistory:
+    # Files opened from the window, ranked by frecency: every launch adds one to the score
+    # of the file, and scores halve every half_life seconds. Names are indexed by the
+    # prefixes of their words, so that searches are answered from the first keystroke.
+    def __init__(self, path=None, max_entries=500, half_life=7 * 86400, debug=False):
+        self._path = path or default_history_path()
+        self._max_entries = max_entries
+        self._half_life = half_life
+        self._debug = debug
+        self._lock = threading.Lock()
+        # url -> [url, name, size, mtime, mimetype, score, last launch]
+        self._entries = {}
+        self._index = {}
+        self._load()
+
+    def _load (self):
+        try:
+            with open(self._path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            if self._debug: print("No launch history:", e)
+            return
+        for entry in entries:
+            self._entries[entry[0]] = entry
+        self._reindex()
+
+    def _save (self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(list(self._entries.values()), f, separators=(',', ':'))
+        os.replace(tmp_path, self._path)
+
+    def _reindex (self):
+        self._index = {}
+        for url, entry in self._entries.items():
+            for token in _tokens(entry[1].lower()):
+                for i in range(1, min(len(token), MAX_PREFIX) + 1):
+                    self._index.setdefault(token[:i], set()).add(url)
+
+    def frecency (self, entry, now=None):
+        now = time.time() if now is None else now
+        return entry[5] * 0.5 ** ((now - entry[6]) / self._half_life)
+
+    def record (self, hit):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(hit.url)
+            score = self.frecency(entry, now) + 1 if entry else 1
+            self._entries[hit.url] = list(hit.fields()) + [score, now]
+
+            # The entries with the lowest frecency are forgotten
+            if len(self._entries) > self._max_entries:
+                ranked = sorted(self._entries.values(), key=lambda entry: self.frecency(entry, now), reverse=True)
+                self._entries = dict((entry[0], entry) for entry in ranked[:self._max_entries])
+            self._reindex()
+            try:
+                self._save()
+            except OSError as e:
+                print("Cannot save launch history:", e)
+
+    def search (self, query_text, limit):
+        # Hits of the launched files whose name has words starting with every word of the query
+        words = query_words(query_text)
+        dirs = split_scope(query_text)[0]
+        if not words:
+            return []
+
+        now = time.time()
+        with self._lock:
+            # Words are split like the names (e.g. 'notes.txt'), the full words are checked below
+            candidates = None
+            for word in words:
+                for token in _tokens(word):
+                    urls = self._index.get(token[:MAX_PREFIX], set())
+                    candidates = urls if candidates is None else candidates & urls
+            entries = list(self._entries.values()) if candidates is None else [self._entries[url] for url in candidates]
+
+        entries = [entry for entry in entries if all(word in entry[1].lower() for word in words)]
+        entries.sort(key=lambda entry: self.frecency(entry, now), reverse=True)
+
+        hits = []
+        for entry in entries:
+            if len(hits) == limit:
+                break
+            if in_scope(entry[0], dirs) and self._exists(entry[0]):
+                hits.append(Hit(*entry[:5]))
+        return hits
+
+    def _exists (self, url):
+        # Files deleted since they were launched are not offered anymore
+        parsed = urllib.parse.urlparse(url)
+        return parsed.scheme != 'file' or os.path.exists(urllib.parse.unquote(parsed.path))
+
+class HistoryLayer(EngineLayer):
+    # Shows the launched files matching the query as soon as it is typed, before the engine
+    # (and the scheduler delay), and keeps them at the top of the final results. The rows
+    # added in front of the engine results shift the offsets of the following pages.
+    def __init__(self, engine_factory, history, result_limit, results_ready_cb=None, debug=True):
+        EngineLayer.__init__(self, engine_factory, results_ready_cb, debug)
+        self._history = history
+        self._result_limit = result_limit
+        self._hits = []
+        self._extra = 0
+
+    def do_search (self, query_text, fts, results_ready_cb=None):
+        # The window passes a callback bound to every search, the results of the previous
+        # one still coming from the engine threads are then not reported as these
+        results_ready_cb = results_ready_cb or self._results_ready_cb
+        # The layers below may hold the search back, whatever they are still answering must
+        # not take the callback and pending key of this one
+        self.cancel()
+        # FTS queries are about the contents, not the names
+        self._hits = [] if fts else self._history.search(query_text, self._result_limit)
+        self._extra = 0
+        if self._hits:
+            if self._debug: print("Launch history:", len(self._hits), "results")
+            results_ready_cb(self._hits, None, partial=True)
+        self._forward(query_text, fts, query_text, results_ready_cb)
+
+    def files_changed (self, removed, updated):
+        self._hits = apply_changes(self._hits, removed, updated)
+        EngineLayer.files_changed(self, removed, updated)
+
+    def fetch_page (self, query_text, fts, offset, count):
+        EngineLayer.fetch_page(self, query_text, fts, offset - self._extra, count)
+
+    def _engine_results_ready (self, result, nres, partial=False, offset=None):
+        if offset is not None:
+            nres = None if nres is None else nres + self._extra
+            EngineLayer._engine_results_ready(self, result, nres, offset=offset + self._extra)
+        elif partial or not self._hits:
+            EngineLayer._engine_results_ready(self, result, nres, partial)
+        else:
+            # Launched files go first, with the values reported by the engine when it has them
+            fresh = dict((hit.url, hit) for hit in result)
+            launched_urls = set(hit.url for hit in self._hits)
+            self._extra = len(launched_urls - set(fresh))
+            merged = [fresh.get(hit.url, hit) for hit in self._hits] + [hit for hit in result if hit.url not in launched_urls]
+            EngineLayer._engine_results_ready(self, merged, nres + self._extra)
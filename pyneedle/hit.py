@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Search hits, the same for every engine: the raw fields (with the size in bytes and the
+# modification time in seconds since the epoch) are kept in slots, and the text shown for
+# them is only computed the first time the view asks for it.
+#
+import html, time, urllib.parse
+
+def sizeof_fmt (num):
+    for x in ['bytes', 'KB', 'MB', 'GB', 'TB']:
+        if num < 1024.0:
+            return '%3.1f %s' % (num, x)
+        num /= 1024.0
+    return '%3.1f %s' % (num, 'PB')
+
+class Hit:
+    __slots__ = ('url', 'name', 'size', 'mtime', 'mimetype', '_path', '_size_text', '_date_text', '_tooltip')
+
+    def __init__(self, url, name, size, mtime, mimetype):
+        self.url = url
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.mimetype = mimetype
+        self._path = None
+        self._size_text = None
+        self._date_text = None
+        self._tooltip = None
+
+    def __reduce__ (self):
+        # Only the raw fields are sent between processes
+        return (Hit, self.fields())
+
+    def __eq__ (self, other):
+        return isinstance(other, Hit) and self.fields() == other.fields()
+
+    def __hash__ (self):
+        return hash(self.fields())
+
+    def __repr__ (self):
+        return 'Hit' + repr(self.fields())
+
+    def fields (self):
+        return (self.url, self.name, self.size, self.mtime, self.mimetype)
+
+    @property
+    def path (self):
+        # Local path of the file (the URL path for other schemes)
+        if self._path is None:
+            self._path = urllib.parse.unquote(urllib.parse.urlparse(self.url).path)
+        return self._path
+
+    @property
+    def size_text (self):
+        if self._size_text is None:
+            self._size_text = sizeof_fmt(float(self.size))
+        return self._size_text
+
+    @property
+    def date_text (self):
+        if self._date_text is None:
+            self._date_text = time.strftime('%d/%m/%y', time.localtime(self.mtime))
+        return self._date_text
+
+    @property
+    def tooltip (self):
+        if self._tooltip is None:
+            self._tooltip = html.escape(self.path, quote=True)
+        return self._tooltip
+
+def apply_changes (hits, removed, updated):
+    # Copy of a result without the removed URLs and with the updated hits (by URL) in place
+    # of the old ones, kept newest first as the engines return them
+    changed = [updated.get(hit.url, hit) for hit in hits if hit.url not in removed]
+    if updated:
+        changed.sort(key=lambda hit: hit.mtime, reverse=True)
+    return changed
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+from gi.repository import Gtk, Gio, GdkPixbuf
+import collections
+
+class IconCache:
+    def __init__(self, max_entries=256, fallback='text-x-generic', debug=False):
+        self._max_entries = max_entries
+        self._fallback = fallback
+        self._debug = debug
+        self._pixbufs = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        # Loaded pixbufs are only valid for the current icon theme
+        self._theme = Gtk.IconTheme.get_default()
+        self._theme.connect('changed', self._on_theme_changed)
+
+    def get_icon (self, name, size=20, flags=0):
+        return self._lookup(('icon', name, size), lambda: self._load_icon(name, size, flags))
+
+    def get_content_type_icon (self, content_type, size=20):
+        return self._lookup((content_type, size), lambda: self._load_content_type_icon(content_type, size))
+
+    def clear (self):
+        self._pixbufs.clear()
+
+    def _lookup (self, key, loader):
+        try:
+            pixbuf = self._pixbufs[key]
+            self._pixbufs.move_to_end(key)
+            self.hits += 1
+            return pixbuf
+        except KeyError:
+            self.misses += 1
+
+        pixbuf = loader()
+        self._pixbufs[key] = pixbuf
+        if len(self._pixbufs) > self._max_entries:
+            self._pixbufs.popitem(last=False)
+
+        return pixbuf
+
+    def _load_content_type_icon (self, content_type, size):
+        # Try every name suggested for the MIME type before using the fallback
+        names = Gio.content_type_get_icon(content_type).get_names() if content_type else []
+        for name in list(names) + [self._fallback]:
+            pixbuf = self._load_icon(name, size)
+            if pixbuf:
+                return pixbuf
+        return None
+
+    def _load_icon (self, name, size, flags=0):
+        try:
+            pixbuf = self._theme.load_icon(name, size, flags)
+            return pixbuf.scale_simple(size, size, GdkPixbuf.InterpType.HYPER)
+        except Exception as ex:
+            if self._debug: print("Exception loading icon:", ex)
+            return None
+
+    def _on_theme_changed (self, theme):
+        if self._debug: print("Icon theme changed, dropping", len(self._pixbufs), "cached icons")
+        self.clear()
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import threading
+
+class EngineLayer:
+    # Base class for objects sitting between the window and a search engine.
+    # A layer looks like an engine (do_search, cancel, name) and is built from
+    # a factory receiving the callback the wrapped engine has to report to.
+    # Engines may stream rows with results_ready_cb(batch, None, partial=True)
+    # before the final results_ready_cb(result, nres) call with every row, and
+    # answer fetch_page() requests with results_ready_cb(rows, nres, offset=offset).
+    def __init__(self, engine_factory, results_ready_cb=None, debug=True):
+        self._engine = engine_factory(self._engine_results_ready)
+        self._results_ready_cb = results_ready_cb
+        self._debug = debug
+        self._lock = threading.Lock()
+
+        # Key of the search the engine is working on (None when there is none)
+        self._pending = None
+
+    @property
+    def name (self):
+        return self._engine.name
+
+    def index_version (self):
+        return self._engine.index_version()
+
+    def can_answer (self, query_text, fts):
+        # True when the search would be answered without waiting for the engine
+        can_answer = getattr(self._engine, 'can_answer', None)
+        return can_answer(query_text, fts) if can_answer else False
+
+    def files_changed (self, removed, updated):
+        # Files deleted (set of URLs) or modified (new hits by URL) since they were found:
+        # layers keeping results patch them, and the call goes on down to the engine
+        files_changed = getattr(self._engine, 'files_changed', None)
+        if files_changed:
+            files_changed(removed, updated)
+
+    def fetch_page (self, query_text, fts, offset, count):
+        # Pages of a search are always read from the engine
+        self._engine.fetch_page(query_text, fts, offset, count)
+
+    def cancel (self):
+        with self._lock:
+            self._pending = None
+        self._engine.cancel()
+
+    def close (self):
+        # The layers are dropped with their engine (e.g. when switching engines), engines
+        # with processes or threads of their own stop them
+        self.cancel()
+        close = getattr(self._engine, 'close', None)
+        if close:
+            close()
+
+    def _forward (self, query_text, fts, key, results_ready_cb=None):
+        # A callback given with the search replaces the previous one along with the
+        # pending key, so that the results taken for this search are reported to it
+        with self._lock:
+            self._pending = key
+            if results_ready_cb:
+                self._results_ready_cb = results_ready_cb
+        self._engine.do_search(query_text, fts)
+
+    def _answer (self, result, nres):
+        # Whatever the engine is still doing is not needed anymore
+        self.cancel()
+        self._results_ready_cb(result, nres)
+
+    def _engine_results_ready (self, result, nres, partial=False, offset=None):
+        with self._lock:
+            key = self._pending
+            results_ready_cb = self._results_ready_cb
+            if offset is None and not partial:
+                self._pending = None
+
+        if offset is not None:
+            results_ready_cb(result, nres, offset=offset)
+            return
+
+        if key is None:
+            # Search already answered by this layer
+            if self._debug: print(self.__class__.__name__, "dropping superseded engine results")
+            return
+
+        # Streamed batches are passed along, only final results are kept by the layers
+        if partial:
+            results_ready_cb(result, nres, partial=True)
+            return
+
+        self._results_ready(key, result, nres)
+        results_ready_cb(result, nres)
+
+    def _results_ready (self, key, result, nres):
+        pass
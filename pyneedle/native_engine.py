@@ -0,0 +1,454 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import array, bisect, mimetypes, mmap, os, stat, struct, threading, time
+import urllib.parse
+from .tracing import tracer
+from .scope import split_scope, is_under
+from .hit import Hit
+
+# Index file layout (little endian, every section aligned to 8 bytes):
+#
+#   header   magic, version, number of dirs, files, trigrams and roots, build time, section
+#            offsets
+#   dirs     parent (int32), mtime_ns (int64) and path offsets (uint64) of every directory
+#   files    dir (uint32), size (int64), mtime (int64), name offsets (uint64) of every file,
+#            sorted by descending modification time (file id 0 is the newest one)
+#   names    file names, and lower-cased file names each one followed by '/' (which
+#            cannot appear in a name) so that a substring never spans two names
+#   trigrams sorted trigram keys (uint32) and offsets (uint64) into the postings, which
+#            hold the ascending ids of the files whose lower-cased name contains them
+#   roots    path offsets (uint64) and paths of the crawled folders
+#
+_MAGIC = b'PYNDLIDX'
+_VERSION = 2
+_HEADER = struct.Struct('<8sIIIIId' + 'Q' * 16)
+
+# Seconds after which the index is crawled again
+RESCAN_INTERVAL = 900
+
+def _encode (text):
+    return text.encode('utf-8', 'surrogateescape')
+
+def _decode (data):
+    return bytes(data).decode('utf-8', 'surrogateescape')
+
+def _trigrams (lower_name):
+    return {lower_name[i:i + 3] for i in range(len(lower_name) - 2)}
+
+def default_index_path ():
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_dir, 'pyneedle', 'native.idx')
+
+
+class NativeIndex:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        header = _HEADER.unpack_from(view)
+        if header[0] != _MAGIC or header[1] != _VERSION:
+            raise ValueError('Unsupported index file ' + path)
+        self.ndirs, self.nfiles, self.ntrigrams, nroots = header[2:6]
+        # Time when the crawl started
+        self.built = header[6]
+        offsets = iter(header[7:])
+
+        def section (fmt, count):
+            offset = next(offsets)
+            return view[offset:offset + count * struct.calcsize(fmt)].cast(fmt)
+
+        self._dir_parent = section('i', self.ndirs)
+        self._dir_mtime = section('q', self.ndirs)
+        self._dir_offsets = section('Q', self.ndirs + 1)
+        self._dir_paths = section('B', self._dir_offsets[self.ndirs])
+        self._file_dir = section('I', self.nfiles)
+        self._file_size = section('q', self.nfiles)
+        self._file_mtime = section('q', self.nfiles)
+        self._name_offsets = section('Q', self.nfiles + 1)
+        self._names = section('B', self._name_offsets[self.nfiles])
+        self._lower_offsets = section('Q', self.nfiles + 1)
+        # Lower-cased names are searched in place in the map
+        self._lower_start = next(offsets)
+        self._trigram_keys = section('I', self.ntrigrams)
+        self._posting_offsets = section('Q', self.ntrigrams + 1)
+        self._postings = section('I', self._posting_offsets[self.ntrigrams])
+        root_offsets = section('Q', nroots + 1)
+        root_paths = section('B', root_offsets[nroots])
+        self.roots = tuple(_decode(root_paths[root_offsets[i]:root_offsets[i + 1]]) for i in range(nroots))
+        self._last_scope = (None, None)
+
+    def close (self):
+        self._mmap.close()
+
+    def dir_path (self, dir_id):
+        return _decode(self._dir_paths[self._dir_offsets[dir_id]:self._dir_offsets[dir_id + 1]])
+
+    def dirs (self):
+        for dir_id in range(self.ndirs):
+            yield self.dir_path(dir_id), self._dir_parent[dir_id], self._dir_mtime[dir_id]
+
+    def files (self):
+        for file_id in range(self.nfiles):
+            yield self._file_dir[file_id], self.name(file_id), self._file_size[file_id], self._file_mtime[file_id]
+
+    def name (self, file_id):
+        return _decode(self._names[self._name_offsets[file_id]:self._name_offsets[file_id + 1]])
+
+    def path (self, file_id):
+        return os.path.join(self.dir_path(self._file_dir[file_id]), self.name(file_id))
+
+    def size (self, file_id):
+        return self._file_size[file_id]
+
+    def mtime (self, file_id):
+        return self._file_mtime[file_id]
+
+    def _posting (self, trigram):
+        key = int.from_bytes(trigram, 'big')
+        i = bisect.bisect_left(self._trigram_keys, key)
+        if i == self.ntrigrams or self._trigram_keys[i] != key:
+            return None
+        return self._postings[self._posting_offsets[i]:self._posting_offsets[i + 1]]
+
+    def _scan (self, word):
+        # Ids of the names containing a word too short to have trigrams, in ascending order
+        end = self._lower_start + self._lower_offsets[self.nfiles]
+        pos = self._mmap.find(word, self._lower_start, end)
+        while pos != -1:
+            file_id = bisect.bisect_right(self._lower_offsets, pos - self._lower_start) - 1
+            yield file_id
+            # Continue after the end of this name
+            pos = self._mmap.find(word, self._lower_start + self._lower_offsets[file_id + 1], end)
+
+    def _matches (self, file_id, words):
+        start = self._lower_start + self._lower_offsets[file_id]
+        end = self._lower_start + self._lower_offsets[file_id + 1]
+        for word in words:
+            if self._mmap.find(word, start, end) == -1:
+                return False
+        return True
+
+    def _scope_ids (self, dirs):
+        # Ids of the topmost indexed folders under the scope folders (the scope of the last
+        # search is remembered, as it is usually the same while typing)
+        if self._last_scope[0] == dirs:
+            return self._last_scope[1]
+        scope_ids = set()
+        for dir_id in range(self.ndirs):
+            parent = self._dir_parent[dir_id]
+            if (parent < 0 or parent not in scope_ids) and any(is_under(self.dir_path(dir_id), directory) for directory in dirs):
+                scope_ids.add(dir_id)
+        self._last_scope = (dirs, scope_ids)
+        return scope_ids
+
+    def _in_scope (self, dir_id, scope_ids, memo):
+        # Walks up the folders until one under the scope (or the root), remembering the answer
+        chain = []
+        while dir_id >= 0 and dir_id not in memo and dir_id not in scope_ids:
+            chain.append(dir_id)
+            dir_id = self._dir_parent[dir_id]
+        inside = dir_id in scope_ids or memo.get(dir_id, False)
+        for walked in chain:
+            memo[walked] = inside
+        return inside
+
+    def search (self, words, limit, count_limit=0, dirs=()):
+        # Returns the ids of the newest 'limit' files whose name contains all the words (and
+        # that are under any of the dirs, if given), and the total number of matches (or
+        # count_limit + 1 when there are more than count_limit)
+        words = [_encode(word) for word in words if word]
+        if not words or not self.nfiles:
+            return [], 0
+
+        scope_ids = self._scope_ids(dirs) if dirs else None
+        if scope_ids is not None and not scope_ids:
+            return [], 0
+        memo = {}
+
+        # Only the names in the shortest posting list can contain every word
+        candidates = None
+        for word in words:
+            for trigram in _trigrams(word):
+                posting = self._posting(trigram)
+                if posting is None:
+                    return [], 0
+                if candidates is None or len(posting) < len(candidates):
+                    candidates = posting
+        if candidates is None:
+            candidates = self._scan(max(words, key=len))
+
+        file_ids = []
+        nres = 0
+        for file_id in candidates:
+            if scope_ids is not None and not self._in_scope(self._file_dir[file_id], scope_ids, memo):
+                continue
+            if self._matches(file_id, words):
+                if nres < limit:
+                    file_ids.append(file_id)
+                nres += 1
+                if count_limit and nres > count_limit and nres >= limit:
+                    break
+        return file_ids, nres
+
+
+def _crawl (roots, previous, hidden, debug):
+    # Returns the list of (path, parent, mtime_ns) directories and (dir, name, size, mtime,
+    # is_dir) files under the roots. Directories whose mtime did not change since the
+    # previous index reuse its entries instead of being listed again.
+    previous_dirs = {}
+    previous_files = {}
+    if previous is not None:
+        for dir_id, (path, parent, mtime_ns) in enumerate(previous.dirs()):
+            previous_dirs[path] = (dir_id, mtime_ns)
+        for dir_id, name, size, mtime in previous.files():
+            previous_files.setdefault(dir_id, []).append((name, size, mtime))
+
+    dirs = []
+    files = []
+    reused = 0
+    pending = [(os.path.abspath(os.path.expanduser(root)), -1) for root in roots]
+    while pending:
+        path, parent = pending.pop()
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+
+        dir_id = len(dirs)
+        dirs.append((path, parent, mtime_ns))
+
+        previous_dir = previous_dirs.get(path)
+        if previous_dir is not None and previous_dir[1] == mtime_ns:
+            # Same names, but editing a file does not touch its directory: only the listing
+            # is reused, every file is stat'ed again
+            reused += 1
+            entries = []
+            for name, size, mtime in previous_files.get(previous_dir[0], []):
+                try:
+                    st = os.lstat(os.path.join(path, name))
+                except OSError:
+                    continue
+                is_dir = stat.S_ISDIR(st.st_mode)
+                entries.append((name, -1 if is_dir else st.st_size, int(st.st_mtime), is_dir))
+        else:
+            entries = []
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if not hidden and entry.name.startswith('.'):
+                            continue
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        is_dir = stat.S_ISDIR(st.st_mode)
+                        # Directories are stored with a negative size
+                        entries.append((entry.name, -1 if is_dir else st.st_size, int(st.st_mtime), is_dir))
+            except OSError:
+                continue
+
+        for name, size, mtime, is_dir in entries:
+            files.append((dir_id, name, size, mtime))
+            if is_dir:
+                pending.append((os.path.join(path, name), dir_id))
+
+    if debug: print("Native index crawled", len(dirs), "directories (" + str(reused) + " unchanged) and", len(files), "files")
+    return dirs, files
+
+
+def _write_index (path, dirs, files, roots, built):
+    # Newest files first, so that the first matches in a posting list are the top-k
+    files.sort(key=lambda f: f[3], reverse=True)
+
+    dir_paths = [_encode(d[0]) for d in dirs]
+    root_paths = [_encode(root) for root in roots]
+    names = [_encode(f[1]) for f in files]
+    lower_names = [_encode(f[1].lower()) + b'/' for f in files]
+
+    postings = {}
+    for file_id, lower_name in enumerate(lower_names):
+        for trigram in _trigrams(lower_name[:-1]):
+            posting = postings.get(trigram)
+            if posting is None:
+                posting = postings[trigram] = array.array('I')
+            posting.append(file_id)
+    trigrams = sorted(postings)
+
+    def offsets (chunks):
+        result = array.array('Q', [0])
+        total = 0
+        for chunk in chunks:
+            total += len(chunk)
+            result.append(total)
+        return result
+
+    posting_offsets = offsets(postings[t] for t in trigrams)
+    lower_offsets = offsets(lower_names)
+    sections = [
+        array.array('i', (d[1] for d in dirs)).tobytes(),
+        array.array('q', (d[2] for d in dirs)).tobytes(),
+        offsets(dir_paths).tobytes(),
+        b''.join(dir_paths),
+        array.array('I', (f[0] for f in files)).tobytes(),
+        array.array('q', (f[2] for f in files)).tobytes(),
+        array.array('q', (f[3] for f in files)).tobytes(),
+        offsets(names).tobytes(),
+        b''.join(names),
+        lower_offsets.tobytes(),
+        b''.join(lower_names),
+        array.array('I', (int.from_bytes(t, 'big') for t in trigrams)).tobytes(),
+        posting_offsets.tobytes(),
+        b''.join(postings[t].tobytes() for t in trigrams),
+        offsets(root_paths).tobytes(),
+        b''.join(root_paths),
+    ]
+
+    # Section offsets, every one aligned to 8 bytes
+    positions = []
+    position = _HEADER.size
+    for section in sections:
+        positions.append(position)
+        position += (len(section) + 7) & ~7
+    header = _HEADER.pack(_MAGIC, _VERSION, len(dirs), len(files), len(trigrams), len(roots), built, *positions)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for section in sections:
+            f.write(section)
+            f.write(b'\0' * (((len(section) + 7) & ~7) - len(section)))
+    os.replace(tmp_path, path)
+
+
+class NativeEngine:
+    def __init__(self, result_limit=20, results_ready_cb=None, debug=True, roots=None, index_path=None,
+                 hidden=False, rescan_interval=RESCAN_INTERVAL, count_limit=0):
+        self._result_limit = result_limit
+        self._count_limit = count_limit
+        self._results_ready_cb = results_ready_cb
+        self._debug = debug
+        self._roots = tuple(os.path.abspath(os.path.expanduser(root)) for root in roots or ['~'])
+        self._index_path = index_path or default_index_path()
+        self._hidden = hidden
+        self._rescan_interval = rescan_interval
+        self._index = None
+        # Index of other folders, only used to speed up the crawl
+        self._previous = None
+        self._index_version = 0
+        self._scanned = 0
+        self._rescan_thread = None
+        self.name = 'Native'
+
+        try:
+            self._index = NativeIndex(self._index_path)
+            self._scanned = self._index.built
+        except (OSError, ValueError) as e:
+            if self._debug: print("No usable native index:", e)
+        if self._index is not None and self._index.roots != self._roots:
+            if self._debug: print("Native index built for", self._index.roots)
+            self._previous, self._index = self._index, None
+
+        # The index is built when there is none for the roots, and brought up to date in the
+        # background when older than the rescan interval (never when it is 0)
+        if self._index is None or (self._rescan_interval and time.time() - self._scanned > self._rescan_interval):
+            self.rescan()
+
+    def index_version (self):
+        return self._index_version
+
+    def rescan (self):
+        if self._rescan_thread and self._rescan_thread.is_alive():
+            return
+        self._scanned = time.time()
+        self._rescan_thread = threading.Thread(target=self._rescan, daemon=True)
+        self._rescan_thread.start()
+
+    def _rescan (self):
+        starttime = time.time()
+        try:
+            dirs, files = _crawl(self._roots, self._index or self._previous, self._hidden, self._debug)
+            _write_index(self._index_path, dirs, files, self._roots, starttime)
+            index = NativeIndex(self._index_path)
+        except (OSError, ValueError) as e:
+            print("Cannot build native index:", e)
+            return
+
+        # Searches running on the old index keep their own reference to it
+        self._index = index
+        self._previous = None
+        self._index_version += 1
+        if self._debug: print("Native index rebuilt in", time.time() - starttime)
+
+    def wait_index (self, timeout=None, rescan=False):
+        # Waits for the first crawl when there was no index yet (and for any running crawl
+        # with rescan)
+        if (self._index is None or rescan) and self._rescan_thread:
+            self._rescan_thread.join(timeout)
+        return self._index is not None
+
+    def do_search (self, query_text, fts):
+        if self._rescan_interval and time.time() - self._scanned > self._rescan_interval:
+            self.rescan()
+
+        rows, nres = self.search_sync(query_text, fts)
+        self._results_ready_cb(rows, nres)
+
+    def search_sync (self, query_text, fts):
+        # There is no content index, FTS queries are also matched against file names
+        index = self._index
+        if index is None:
+            return [], 0
+
+        dirs, query_text = split_scope(query_text)
+        with tracer.span('execute'):
+            file_ids, nres = index.search([word.lower() for word in query_text.split(' ')], self._result_limit, self._count_limit, dirs)
+        return self._rows(index, file_ids), nres
+
+    def fetch_page (self, query_text, fts, offset, count):
+        index = self._index
+        if index is None:
+            self._results_ready_cb([], 0, offset=offset)
+            return
+
+        dirs, query_text = split_scope(query_text)
+        file_ids, nres = index.search([word.lower() for word in query_text.split(' ')], offset + count, self._count_limit, dirs)
+        self._results_ready_cb(self._rows(index, file_ids[offset:]), nres, offset=offset)
+
+    def _rows (self, index, file_ids):
+        result = []
+        for file_id in file_ids:
+            path = index.path(file_id)
+            size = index.size(file_id)
+            mimetype = 'inode/directory' if size < 0 else (mimetypes.guess_type(path)[0] or 'application/octet-stream')
+            result.append(Hit('file://' + urllib.parse.quote(path), index.name(file_id), max(size, 0),
+                              index.mtime(file_id), mimetype))
+        return result
+
+    def cancel (self):
+        # Searches are answered synchronously, there is nothing to cancel
+        pass
@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Preview pane: thumbnails of images (from the freedesktop thumbnail cache when there is a
+# fresh one) and the first lines of text files, for the selected row. Previews are made
+# and decoded by a pool of threads, the rows next to the selected one are prepared in
+# advance, and what had to be generated is kept in a size-capped cache on disk.
+#
+from gi.repository import Gtk, Gio, GLib, GdkPixbuf, Pango
+from .tracing import tracer
+import collections, concurrent.futures, hashlib, os, threading
+
+def _cache_home ():
+    return os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+
+def default_preview_dir ():
+    return os.path.join(_cache_home(), 'pyneedle', 'previews')
+
+class PreviewCache:
+    # LRU of generated previews on disk, by file name. The modification time of the files
+    # keeps their last use, so that the order survives restarts.
+    def __init__(self, path=None, max_bytes=64 << 20, debug=False):
+        self._path = path or default_preview_dir()
+        self._max_bytes = max_bytes
+        self._debug = debug
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._size = 0
+
+        try:
+            files = [(entry.name, entry.stat()) for entry in os.scandir(self._path) if not entry.name.endswith('.tmp')]
+        except OSError:
+            files = []
+        for name, st in sorted(files, key=lambda item: item[1].st_mtime):
+            self._entries[name] = st.st_size
+            self._size += st.st_size
+
+    def get (self, name):
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        try:
+            path = os.path.join(self._path, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            with self._lock:
+                self._size -= self._entries.pop(name, 0)
+            return None
+
+    def put (self, name, data):
+        try:
+            os.makedirs(self._path, exist_ok=True)
+            tmp_path = os.path.join(self._path, name + '.' + str(threading.get_ident()) + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self._path, name))
+        except OSError as e:
+            if self._debug: print("Cannot store preview:", e)
+            return
+
+        with self._lock:
+            self._size += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            evicted = []
+            while self._size > self._max_bytes and len(self._entries) > 1:
+                old_name, size = self._entries.popitem(last=False)
+                self._size -= size
+                evicted.append(old_name)
+        for old_name in evicted:
+            try:
+                os.unlink(os.path.join(self._path, old_name))
+            except OSError:
+                pass
+
+class PreviewLoader:
+    # Makes the previews of the hits on a pool of threads, where images are also decoded,
+    # and hands them over to the main loop. The last previews are kept in memory. Previews
+    # are ('image', pixbuf), ('text', first lines) or None when the file has none.
+    def __init__(self, cache, size=256, workers=2, max_entries=32, text_bytes=4096, text_lines=24, debug=False):
+        self._cache = cache
+        self._size = size
+        self._max_entries = max_entries
+        self._text_bytes = text_bytes
+        self._text_lines = text_lines
+        self._debug = debug
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        # Only used from the main loop: previews by key, and previews being made with the
+        # callbacks waiting for them
+        self._previews = collections.OrderedDict()
+        self._running = {}
+
+    def load (self, hit, callback):
+        # callback(hit, preview) is called from the main loop, right away when the preview
+        # is in memory
+        key = self._key(hit)
+        if key in self._previews:
+            self._previews.move_to_end(key)
+            callback(hit, self._previews[key])
+            return
+        self._start(key, hit).append(lambda preview: callback(hit, preview))
+
+    def prefetch (self, hits):
+        # Previews not started yet of other rows are not needed anymore
+        keys = set(self._key(hit) for hit in hits)
+        for key, (future, callbacks) in list(self._running.items()):
+            if key not in keys and not callbacks and future.cancel():
+                del self._running[key]
+        for hit in hits:
+            key = self._key(hit)
+            if key not in self._previews:
+                self._start(key, hit)
+
+    def _key (self, hit):
+        return hashlib.sha1(('%s\0%d\0%d' % (hit.url, hit.size, int(hit.mtime))).encode('utf-8')).hexdigest()
+
+    def _start (self, key, hit):
+        if key not in self._running:
+            future = self._executor.submit(self._make, key, hit)
+            future.add_done_callback(lambda future: GLib.idle_add(self._done, key, future))
+            self._running[key] = (future, [])
+        return self._running[key][1]
+
+    def _done (self, key, future):
+        running = self._running.get(key)
+        if running is None or running[0] is not future:
+            return False
+        del self._running[key]
+        if future.cancelled():
+            return False
+
+        try:
+            preview = future.result()
+        except Exception as e:
+            if self._debug: print("Preview failed:", e)
+            preview = None
+
+        self._previews[key] = preview
+        if len(self._previews) > self._max_entries:
+            self._previews.popitem(last=False)
+        for callback in running[1]:
+            callback(preview)
+        return False
+
+    ##############################
+    # Worker threads
+    ##############################
+
+    def _make (self, key, hit):
+        if not hit.url.startswith('file://') or hit.mimetype == 'inode/directory':
+            return None
+
+        with tracer.span('preview'):
+            if hit.mimetype and hit.mimetype.startswith('image/'):
+                return self._image(key, hit)
+            if hit.mimetype and Gio.content_type_is_a(hit.mimetype, 'text/plain'):
+                return self._text(key, hit)
+        return None
+
+    def _image (self, key, hit):
+        pixbuf = self._thumbnail(hit)
+        if pixbuf is not None:
+            return ('image', pixbuf)
+
+        data = self._cache.get(key + '.png')
+        if data is None:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(hit.path, self._size, self._size, True)
+            self._cache.put(key + '.png', pixbuf.save_to_bufferv('png', [], [])[1])
+            return ('image', pixbuf)
+
+        loader = GdkPixbuf.PixbufLoader.new_with_type('png')
+        loader.write(data)
+        loader.close()
+        return ('image', loader.get_pixbuf())
+
+    def _thumbnail (self, hit):
+        # Thumbnails of the freedesktop cache are used when made for this version of the file
+        uri = Gio.File.new_for_path(hit.path).get_uri()
+        name = hashlib.md5(uri.encode('utf-8')).hexdigest() + '.png'
+        for folder in ('large', 'normal'):
+            path = os.path.join(_cache_home(), 'thumbnails', folder, name)
+            if not os.path.exists(path):
+                continue
+            try:
+                pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
+            except GLib.Error:
+                continue
+            if pixbuf.get_option('tEXt::Thumb::MTime') == str(int(hit.mtime)):
+                return pixbuf
+        return None
+
+    def _text (self, key, hit):
+        data = self._cache.get(key + '.txt')
+        if data is None:
+            with open(hit.path, 'rb') as f:
+                head = f.read(self._text_bytes)
+            if b'\0' in head:
+                return None
+            lines = head.decode('utf-8', 'replace').splitlines()[:self._text_lines]
+            data = '\n'.join(lines).encode('utf-8')
+            self._cache.put(key + '.txt', data)
+        return ('text', data.decode('utf-8'))
+
+class PreviewPane(Gtk.Box):
+    # Shows the preview of the selected hit, or the icon of its type when it has none
+    def __init__(self, loader, icon_cache, size=256):
+        Gtk.Box.__init__(self, orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        self._loader = loader
+        self._icon_cache = icon_cache
+        self._size = size
+        self._hit = None
+        self.set_size_request(size + 12, -1)
+
+        self._image = Gtk.Image()
+        self.pack_start(self._image, False, False, 0)
+        self._text = Gtk.Label('')
+        self._text.set_halign(Gtk.Align.START)
+        self._text.set_valign(Gtk.Align.START)
+        self._text.set_line_wrap(True)
+        self._text.set_line_wrap_mode(Pango.WrapMode.CHAR)
+        self._text.set_max_width_chars(40)
+        self.pack_start(self._text, True, True, 0)
+
+    def show_hit (self, hit, neighbours=()):
+        self._hit = hit
+        if hit is None:
+            self._image.clear()
+            self._text.set_text('')
+        else:
+            # Until the preview is ready
+            self._show(hit, None)
+            self._loader.load(hit, self._show)
+        self._loader.prefetch(list(neighbours))
+
+    def _show (self, hit, preview):
+        if hit is not self._hit:
+            return
+        if preview is not None and preview[0] == 'image':
+            self._image.set_from_pixbuf(preview[1])
+        else:
+            self._image.set_from_pixbuf(self._icon_cache.get_content_type_icon(hit.mimetype, size=64))
+        if preview is not None and preview[0] == 'text':
+            self._text.set_markup('<small><tt>' + GLib.markup_escape_text(preview[1]) + '</tt></small>')
+        else:
+            self._text.set_text('')
@@ -25,16 +25,20 @@
 #
 import gi
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, Pango, Gio, GdkPixbuf, Gdk, GLib, GObject
-import sys, subprocess, time, os, argparse, html
-
-# Needed for python2/3 compatibility
-if sys.version_info.major == 2:
-    import urlparse
-    urlparse_generic = urlparse
-else:
-    import urllib.parse
-    urlparse_generic = urllib.parse
+from gi.repository import Gtk, Pango, Gdk, GLib, GObject
+import sys, subprocess, os, argparse, functools, html
+from .icon_cache import IconCache
+from .refine import QueryRefiner, query_words, matches
+from .result_cache import ResultCache, CachingEngine
+from .scheduler import SearchScheduler
+from .history import LaunchHistory, HistoryLayer
+from .scope import SCOPE_PREFIX, scope_word, split_scope, in_scope
+from .hit import apply_changes
+from .watcher import ResultWatcher
+from .preview import PreviewCache, PreviewLoader, PreviewPane
+from .result_model import ResultModel
+from .tracing import tracer
+from . import resident
 
 class PyNeedle (Gtk.Window):
 
@@ -46,28 +50,56 @@ class PyNeedle (Gtk.Window):
         'select-tracker' : (GObject.SIGNAL_ACTION, GObject.TYPE_NONE, ()),
         'select-recoll' : (GObject.SIGNAL_ACTION, GObject.TYPE_NONE, ()),
         'select-recoll-mp' : (GObject.SIGNAL_ACTION, GObject.TYPE_NONE, ()),
+        'select-federated' : (GObject.SIGNAL_ACTION, GObject.TYPE_NONE, ()),
         'exit' : (GObject.SIGNAL_ACTION, GObject.TYPE_NONE, ())
     }
 
-    def __init__ (self, launcher='xdg-open', terminal='xfce4-terminal', engine='tracker', debug=False):
+    def __init__ (self, launcher='xdg-open', terminal='xfce4-terminal', engine='tracker', debug=False, native_roots=None, count_limit=1000,
+                  result_limit=20, federated_engines=('tracker', 'recoll_mp'), stats=False,
+                  resident=False, scope=None, recoll_confdirs=None, preview=False):
         self._launcher = launcher
         self._terminal = terminal
         self._debug = debug
+        self._native_roots = native_roots
+        self._recoll_confdirs = recoll_confdirs or []
+        self._count_limit = count_limit
+        self._result_limit = result_limit
+        self._federated_engines = federated_engines
+        self._resident = resident
+        # Folders searched when the query does not give its own 'in:' scope
+        self._scope = [scope_word(directory) for directory in scope or []]
+        self._search_id = 0
+        self._search_span = None
+        self._streaming = False
+
+        # Paging state: current query, total count, offset of the page being read (if any),
+        # rows of the next page read in advance, and whether the user is waiting for them
+        self._query = None
+        self._nres = 0
+        self._page_offset = None
+        self._page_rows = None
+        self._want_page = False
+        self._icon_cache = IconCache(debug=debug)
+        self._result_cache = ResultCache()
+        self._history = LaunchHistory(debug=debug)
+        # Displayed results follow the changes of their files
+        self._watcher = ResultWatcher(self._files_changed, debug=debug)
 
         # Create main window
         Gtk.Window.__init__(self)
         self.set_size_request(600, 300)
         self.set_position(Gtk.WindowPosition.CENTER)
         self.set_default_icon(self._get_icon('edit-find', size=256))
-        self.connect('delete-event', Gtk.main_quit)
+        self.connect('delete-event', self._close)
         self.connect('toggle-fts', self._on_toggle_fts)
         self.connect('open-in-folder', self._on_open_folder_kb)
         self.connect('open-in-terminal', self._on_open_terminal_kb)
         self.connect('select-tracker', self._select_tracker)
         self.connect('select-recoll', self._select_recoll)
         self.connect('select-recoll-mp', self._select_recoll_mp)
+        self.connect('select-federated', self._select_federated)
         self.connect('show', self._on_window_show)
-        self.connect('exit', Gtk.main_quit)
+        self.connect('exit', self._close)
 
         # Create main vertical box
         vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
@@ -89,12 +121,14 @@ class PyNeedle (Gtk.Window):
 
         vbox.pack_start(hbox, False, False, 0)
 
-        # Create List store for the results
-        self._store = Gtk.ListStore(str, str, str, str, GdkPixbuf.Pixbuf, str)
+        # Create the model for the results, rows are only formatted when they are displayed
+        self._store = ResultModel(self._format_row)
 
         # Create the treeview for the view
         self._tree = Gtk.TreeView(self._store)
         self._tree.set_property('rules-hint', True)
+        # Fixed height rows: only the visible rows need to be measured and formatted
+        self._tree.set_fixed_height_mode(True)
         self._tree.connect('row-activated', self._on_row_clicked)
         self._tree.connect('button-press-event', self._on_row_button)
         self._tree.enable_model_drag_source(Gdk.ModifierType.BUTTON1_MASK, [('text/uri-list', 0, 0)], Gdk.DragAction.DEFAULT | Gdk.DragAction.COPY)
@@ -104,12 +138,15 @@ class PyNeedle (Gtk.Window):
         icon_renderer = Gtk.CellRendererPixbuf()
         icon_column = Gtk.TreeViewColumn('Icon', icon_renderer)
         icon_column.add_attribute(icon_renderer, 'pixbuf', 4)
+        icon_column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        icon_column.set_fixed_width(32)
         self._tree.append_column(icon_column)
 
         # Create second column of hte view (file name) as model[0]
         text_renderer_ellipsize = Gtk.CellRendererText(ellipsize=Pango.EllipsizeMode.MIDDLE)
         text_column = Gtk.TreeViewColumn('Name', text_renderer_ellipsize, text=0)
         text_column.set_property("resizable", True)
+        text_column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
         text_column.set_expand(True)
         self._tree.append_column(text_column)
 
@@ -117,11 +154,15 @@ class PyNeedle (Gtk.Window):
         text_renderer = Gtk.CellRendererText()
         text_column = Gtk.TreeViewColumn('Size', text_renderer, text=2)
         text_column.set_property("resizable", True)
+        text_column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        text_column.set_fixed_width(90)
         self._tree.append_column(text_column)
 
         # Create forth column of the view (modification date) as model[3]
         text_column = Gtk.TreeViewColumn('Modification date', text_renderer, text=3)
         text_column.set_property("resizable", True)
+        text_column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        text_column.set_fixed_width(130)
         self._tree.append_column(text_column)
 
         # Create row tooltip (file URL) as model[5]. This value allows markup, hence it needs to be processed
@@ -130,12 +171,31 @@ class PyNeedle (Gtk.Window):
         # Add treeview to the Vbox
         scrolled = Gtk.ScrolledWindow()
         scrolled.add(self._tree)
-        vbox.pack_start(scrolled, True, True, 0)
+        scrolled.get_vadjustment().connect('value-changed', self._on_scrolled)
+
+        # Preview of the selected row at the right of the results
+        self._preview = None
+        if preview:
+            self._preview = PreviewPane(PreviewLoader(PreviewCache(debug=debug), debug=debug), self._icon_cache)
+            self._tree.get_selection().connect('changed', self._on_selection_changed)
+            paned = Gtk.Paned(orientation=Gtk.Orientation.HORIZONTAL)
+            paned.pack1(scrolled, True, False)
+            paned.pack2(self._preview, False, False)
+            vbox.pack_start(paned, True, True, 0)
+        else:
+            vbox.pack_start(scrolled, True, True, 0)
 
         # Add the label to the Vbox
         self._label = Gtk.Label('')
         vbox.pack_start(self._label, False, False, 0)
 
+        # Timings of the search stages, refreshed every second
+        if stats:
+            self._stats_label = Gtk.Label('')
+            self._stats_label.set_halign(Gtk.Align.START)
+            vbox.pack_start(self._stats_label, False, False, 0)
+            GLib.timeout_add_seconds(1, self._update_stats)
+
         # Create action group for the popup menu
         action_group = Gtk.ActionGroup('my_actions')
         self._add_popup_menu_actions(action_group)
@@ -176,6 +236,8 @@ class PyNeedle (Gtk.Window):
         self.add_accelerator('select-recoll-mp', my_accelerators, key, mod, Gtk.AccelFlags.VISIBLE)
         key, mod = Gtk.accelerator_parse('<Control>3')
         self.add_accelerator('select-recoll', my_accelerators, key, mod, Gtk.AccelFlags.VISIBLE)
+        key, mod = Gtk.accelerator_parse('<Control>4')
+        self.add_accelerator('select-federated', my_accelerators, key, mod, Gtk.AccelFlags.VISIBLE)
 
         self.add_accel_group(my_accelerators)
 
@@ -183,18 +245,7 @@ class PyNeedle (Gtk.Window):
         self._terminal_open_folder_opt = '--working-directory='
 
         # Define the search engine
-        if engine == 'recoll':
-            from . import recoll_engine
-            self._engine = recoll_engine.RecollEngineSP(20, self._update_list_store_cb, debug)
-        elif engine == 'recoll_mp':
-            from . import recoll_engine
-            self._engine = recoll_engine.RecollEngineMP(20, self._update_list_store_cb, debug)
-        elif engine == 'recoll_nt':
-            from . import recoll_engine
-            self._engine = recoll_engine.RecollEngineNT(20, self._update_list_store_cb, debug)
-        else:
-            from . import tracker_engine
-            self._engine = tracker_engine.TrackerEngine(20, self._update_list_store_cb, debug)
+        self._engine = self._create_engine(engine)
 
         self.set_title('PyNeedle (' + self._engine.name + ')')
 
@@ -202,11 +253,11 @@ class PyNeedle (Gtk.Window):
     # Auxiliary methods
     ##############################
 
-    def _sizeof_fmt (self, num):
-        for x in ['bytes', 'KB', 'MB', 'GB', 'TB']:
-            if num < 1024.0:
-                return '%3.1f %s' % (num, x)
-            num /= 1024.0
+    def _count_fmt (self, nres):
+        # Engines report count_limit + 1 when they stopped counting
+        if self._count_limit and nres > self._count_limit:
+            return str(self._count_limit) + '+'
+        return str(nres)
 
     def _add_popup_menu_actions (self, action_group):
         ifactory = Gtk.IconFactory()
@@ -218,34 +269,94 @@ class PyNeedle (Gtk.Window):
             ('OpenTerminal', 'terminal', 'Open parent in terminal', None, None, self._on_open_terminal),
         ])
 
+    def _engine_factory (self, engine):
+        if engine == 'recoll':
+            from . import recoll_engine
+            return lambda cb: recoll_engine.RecollEngineSP(self._result_limit, cb, self._debug, count_limit=self._count_limit)
+        elif engine == 'recoll_mp':
+            from . import recoll_engine
+            return lambda cb: recoll_engine.RecollEngineMP(self._result_limit, cb, self._debug, count_limit=self._count_limit)
+        elif engine == 'recoll_sharded':
+            from . import recoll_engine
+            return lambda cb: recoll_engine.RecollEngineSharded(self._result_limit, cb, self._debug, count_limit=self._count_limit,
+                                                                confdirs=self._recoll_confdirs)
+        elif engine == 'recoll_nt':
+            from . import recoll_engine
+            return lambda cb: recoll_engine.RecollEngineNT(self._result_limit, cb, self._debug, count_limit=self._count_limit)
+        elif engine == 'native':
+            from . import native_engine
+            return lambda cb: native_engine.NativeEngine(self._result_limit, cb, self._debug, roots=self._native_roots, count_limit=self._count_limit)
+        elif engine == 'federated':
+            from . import federated_engine
+            factories = [self._engine_factory(name) for name in self._federated_engines]
+            return lambda cb: federated_engine.FederatedEngine(self._result_limit, cb, self._debug, engine_factories=factories)
+        else:
+            from . import tracker_engine
+            tracker_engine.TrackerEngine.add_change_listener(self._watcher.file_changed)
+            return lambda cb: tracker_engine.TrackerEngine(self._result_limit, cb, self._debug, count_limit=self._count_limit)
+
+    def _create_engine (self, engine):
+        engine_factory = self._engine_factory(engine)
+
+        # Searches are debounced by the scheduler, repeated searches are answered from the cache
+        # shared by all the engines, and filename searches extending the previous one are
+        # answered locally when possible
+        refiner_factory = lambda cb: QueryRefiner(engine_factory, cb, self._debug)
+        cache_factory = lambda cb: CachingEngine(refiner_factory, self._result_cache, self._result_limit, cb, self._debug)
+        # Launched files matching the query are shown before anything else
+        scheduler_factory = lambda cb: SearchScheduler(cache_factory, cb, self._debug)
+        return HistoryLayer(scheduler_factory, self._history, self._result_limit,
+                            functools.partial(self._update_list_store_cb, self._search_id), self._debug)
+
+    def _query_text (self):
+        text = self._query_entry.get_text()
+        if self._scope and not any(word.startswith(SCOPE_PREFIX) for word in text.split(' ')):
+            return ' '.join([text] + self._scope)
+        return text
+
+    def _close (self, *args):
+        # Resident windows are hidden and reset, ready to be shown again by the next invocation
+        if not self._resident:
+            Gtk.main_quit()
+            return True
+
+        self.hide()
+        self._query_entry.set_text('')
+        return True
+
+    def present_search (self):
+        self.show()
+        self.present()
+        self._query_entry.grab_focus()
+
     def _get_icon (self, name, size=20, flags=0):
-        try:
-            pixbuf = Gtk.IconTheme.get_default().load_icon(name, size, flags)
-            pixbuf = pixbuf.scale_simple(size, size, GdkPixbuf.InterpType.HYPER)
-            return pixbuf
-        except Exception as ex:
-            print("Exception loading icon:", ex)
-            return None
+        return self._icon_cache.get_icon(name, size, flags)
 
     ##############################
     # Signal processing methods
     ##############################
 
     def _select_tracker(self, widget):
-        import tracker_engine
-        self._engine = tracker_engine.TrackerEngine(20, self._update_list_store_cb, self._debug)
+        self._engine.close()
+        self._engine = self._create_engine('tracker')
         widget.set_title('PyNeedle (' + self._engine.name + ')')
         self._on_entry_changed(widget)
 
     def _select_recoll(self, widget):
-        import recoll_engine
-        self._engine = recoll_engine.RecollEngineSP(20, self._update_list_store_cb, self._debug)
+        self._engine.close()
+        self._engine = self._create_engine('recoll')
         widget.set_title('PyNeedle (' + self._engine.name + ')')
         self._on_entry_changed(widget)
 
     def _select_recoll_mp(self, widget):
-        import recoll_engine
-        self._engine = recoll_engine.RecollEngineMP(20, self._update_list_store_cb, self._debug)
+        self._engine.close()
+        self._engine = self._create_engine('recoll_mp')
+        widget.set_title('PyNeedle (' + self._engine.name + ')')
+        self._on_entry_changed(widget)
+
+    def _select_federated(self, widget):
+        self._engine.close()
+        self._engine = self._create_engine('federated')
         widget.set_title('PyNeedle (' + self._engine.name + ')')
         self._on_entry_changed(widget)
 
@@ -262,27 +373,26 @@ class PyNeedle (Gtk.Window):
         tree_selection = self._tree.get_selection()
         (model, treeiter) = tree_selection.get_selected()
         subprocess.Popen([self._launcher, model[treeiter][1]])
+        self._history.record(self._store.get_hit(treeiter))
 
     def _on_open_folder_kb(self, widget):
         self._on_open_folder(widget)
-        Gtk.main_quit()
+        self._close()
 
     def _on_open_folder (self, widget):
         tree_selection = self._tree.get_selection()
         (model, treeiter) = tree_selection.get_selected()
-        p = urlparse_generic.urlparse(model[treeiter][1])[2]
-        parent = urlparse_generic.unquote(os.path.dirname(p))
+        parent = os.path.dirname(self._store.get_hit(treeiter).path)
         subprocess.Popen([self._launcher, parent])
 
     def _on_open_terminal_kb(self, widget):
         self._on_open_terminal(widget)
-        Gtk.main_quit()
+        self._close()
 
     def _on_open_terminal (self, widget):
         tree_selection = self._tree.get_selection()
         (model, treeiter) = tree_selection.get_selected()
-        p = urlparse_generic.urlparse(model[treeiter][1])[2]
-        parent = urlparse_generic.unquote(os.path.dirname(p))
+        parent = os.path.dirname(self._store.get_hit(treeiter).path)
         subprocess.Popen([self._terminal, self._terminal_open_folder_opt + parent])
 
     def _on_fts_toggled (self, widget):
@@ -293,15 +403,29 @@ class PyNeedle (Gtk.Window):
         self._tree.grab_focus()
 
     def _on_entry_changed (self, widget):
+        # Results of previous searches still queued in the main loop are not shown anymore
+        self._search_id += 1
+        tracer.new_query()
+        self._streaming = False
+        self._query = (self._query_text(), self._fts_button.get_active())
+        self._page_offset = None
+        self._page_rows = None
+        self._want_page = False
+
         if len(self._query_entry.get_text()) > 1:
-            self._engine.do_search(self._query_entry.get_text(), self._fts_button.get_active())
+            self._search_span = tracer.span('search')
+            # The results are tagged with the search they were asked for
+            self._engine.do_search(self._query[0], self._query[1], functools.partial(self._update_list_store_cb, self._search_id))
         else:
-            self._store.clear()
+            # Single characters are too broad for the engines, only launched files are shown
+            self._engine.cancel()
+            self._store.set_rows(self._history.search(self._query[0], self._result_limit))
+            self._watcher.watch(self._store.get_hits())
             self._label.set_text('')
 
     def _on_row_clicked (self, treeview, path, column):
         self._on_open_document(treeview)
-        Gtk.main_quit()
+        self._close()
 
     def _on_row_button (self, widget, event):
         # Check whether right mouse button was preseed
@@ -312,51 +436,194 @@ class PyNeedle (Gtk.Window):
         elif event.type == Gdk.EventType._2BUTTON_PRESS and event.button == 2:
             self._on_open_document(widget)
 
+    def _on_selection_changed (self, selection):
+        (model, treeiter) = selection.get_selected()
+        if treeiter is None:
+            self._preview.show_hit(None)
+        else:
+            # The rows around are prepared for the next moves of the selection
+            self._preview.show_hit(self._store.get_hit(treeiter), self._store.get_hits_around(treeiter, 2))
+
     def _on_window_show (self, widget):
         self._query_entry.grab_focus()
 
+    def _on_scrolled (self, adjustment):
+        # Show the next page when the view gets within a page of the bottom
+        if adjustment.get_value() + 2 * adjustment.get_page_size() < adjustment.get_upper():
+            return
+
+        if self._page_rows is not None:
+            self._show_page()
+        elif self._page_offset is not None:
+            self._want_page = True
+
     ##############################
     # Search result methods
     ##############################
 
-    def _update_list_store_cb(self, result, nres):
-        GLib.idle_add(self._update_list_store, result, nres)
-
-    def _update_list_store (self, result, nres):
-        # Clean ListStore
-        self._store.clear()
-
-        # For each element in the search results
-        for item in result:
-            # Get icon name based on MIME type
-            iconName = Gio.content_type_get_icon(item[4])
-
-            pixbuf = (self._get_icon(iconName.get_names()[0]) or self._get_icon(iconName.get_names()[1]) or
-                      self._get_icon('text-x-generic'))
-
-            # Pare URL and get parent folder (for the quote)
-            p = urlparse_generic.urlparse(item[0])[2]
-            parent = urlparse_generic.unquote(p)
-
-            # Add current result into the model
-            self._store.append([item[1], item[0], self._sizeof_fmt(float(item[2])), time.strftime('%d/%m/%y', item[3]), pixbuf, html.escape(parent, quote=True)])
-
-        # Update label
-        self._label.set_text('Showing ' + str(len(result)) + ' results of a total of ' + str(nres))
+    def _update_list_store_cb(self, search_id, result, nres, partial=False, offset=None):
+        GLib.idle_add(self._update_list_store, result, nres, partial, search_id, offset)
+
+    def _update_list_store (self, result, nres, partial=False, search_id=None, offset=None):
+        if search_id is not None and search_id != self._search_id:
+            return
+
+        if offset is not None:
+            self._page_ready(result, nres, offset)
+            return
+
+        if partial:
+            # Batch of rows streamed by the engine, the total is not known yet
+            with tracer.span('populate'):
+                if not self._streaming:
+                    self._store.set_rows(result)
+                    self._streaming = True
+                else:
+                    self._store.append_rows(result)
+            self._label.set_text('Showing ' + str(len(self._store)) + ' results')
+            return
+
+        # Only the rows that changed since the previous result are updated
+        self._streaming = False
+        with tracer.span('populate'):
+            self._store.set_rows(result)
+        self._watcher.watch(self._store.get_hits())
+        if self._search_span:
+            self._search_span.end()
+        self._nres = nres
+        self._update_label()
+
+        if self._debug: print("Icon cache hits", self._icon_cache.hits, "misses", self._icon_cache.misses)
+
+        self._prefetch_page()
+
+    def _files_changed (self, removed, updated, created):
+        # Rows are patched in place without searching again, and so are the results kept
+        # by the engine layers
+        self._engine.files_changed(removed, updated)
+        if self._page_rows is not None:
+            self._page_rows = apply_changes(self._page_rows, removed, updated)
+
+        hits = self._store.get_hits()
+        changed = apply_changes(hits, removed, updated)
+        self._nres = max(self._nres - (len(hits) - len(changed)), len(changed))
+
+        # New files are only shown for filename searches matching their names
+        searching = len(self._query_entry.get_text()) > 1
+        query_text, fts = self._query or ('', False)
+        words = query_words(query_text)
+        dirs = split_scope(query_text)[0]
+        created = [hit for hit in created if searching and not fts and matches(hit.name, words) and in_scope(hit.url, dirs)]
+        if created:
+            changed = sorted(created + changed, key=lambda hit: hit.mtime, reverse=True)
+            self._nres += len(created)
+
+        with tracer.span('populate'):
+            self._store.set_rows(changed)
+        self._watcher.watch(self._store.get_hits())
+        if searching and not self._streaming:
+            self._update_label()
+
+    def _update_stats (self):
+        lines = []
+        for name, stats in sorted(tracer.stats().items()):
+            lines.append('%-9s %5d  p50 %7.1f ms  p95 %7.1f ms  p99 %7.1f ms' % (name, stats['count'], stats['p50'] * 1000,
+                                                                              stats['p95'] * 1000, stats['p99'] * 1000))
+        self._stats_label.set_markup('<small><tt>' + html.escape('\n'.join(lines)) + '</tt></small>')
+        return True
+
+    def _update_label (self):
+        self._label.set_text('Showing ' + str(len(self._store)) + ' results of a total of ' + self._count_fmt(self._nres))
+
+    def _prefetch_page (self):
+        # The page following the displayed rows is read before the user scrolls down to it
+        if self._page_offset is not None or self._page_rows is not None or len(self._store) >= self._nres:
+            return
+
+        self._page_offset = len(self._store)
+        self._engine.fetch_page(self._query[0], self._query[1], self._page_offset, self._result_limit)
+
+    def _page_ready (self, rows, nres, offset):
+        if offset != self._page_offset:
+            return
+
+        self._page_offset = None
+        self._page_rows = rows
+        if not rows:
+            # The engine has no more results, whatever the count said
+            self._nres = len(self._store)
+        elif nres is not None:
+            self._nres = nres
+
+        if self._want_page:
+            self._show_page()
+
+    def _show_page (self):
+        self._want_page = False
+        self._store.append_rows(self._page_rows)
+        self._watcher.watch(self._store.get_hits())
+        self._page_rows = None
+        self._update_label()
+        self._prefetch_page()
+
+    def _format_row (self, hit):
+        # Get icon based on MIME type (shared across rows and searches)
+        with tracer.span('icon'):
+            pixbuf = self._icon_cache.get_content_type_icon(hit.mimetype)
+
+        return (hit.name, hit.url, hit.size_text, hit.date_text, pixbuf, hit.tooltip)
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--launcher', dest='launcher', metavar='NAME', default='xdg-open', help='application launcher')
     parser.add_argument('--terminal', dest='terminal', metavar='NAME', default='xfce4-terminal', help='terminal')
-    parser.add_argument('--engine', dest='engine', metavar='NAME', default='recoll', help='engine (tracker, recoll)')
+    parser.add_argument('--engine', dest='engine', metavar='NAME', default='recoll', help='engine (tracker, recoll, recoll_mp, recoll_nt, recoll_sharded, native, federated)')
+    parser.add_argument('--federated-engines', dest='federated_engines', metavar='LIST', default='tracker,recoll_mp', help='comma separated engines queried by the federated engine')
+    parser.add_argument('--recoll-confdir', dest='recoll_confdirs', metavar='DIR', action='append', help='recoll configuration of an index searched by the recoll_sharded engine (can be repeated)')
+    parser.add_argument('--native-root', dest='native_roots', metavar='DIR', action='append', help='folder indexed by the native engine (default: home folder, can be repeated)')
+    parser.add_argument('--scope', dest='scope', metavar='DIR', action='append', help='only search files under DIR (can be repeated, queries can give their own with in:DIR)')
+    parser.add_argument('--limit', dest='result_limit', metavar='N', type=int, default=20, help='maximum number of results shown')
+    parser.add_argument('--count-limit', dest='count_limit', metavar='N', type=int, default=1000, help='stop counting results after N matches (0 for exact counts)')
+    parser.add_argument('--resident', dest='resident', action='store_true', help='keep running in the background when closed, later invocations show the window again')
+    parser.add_argument('--quit', dest='quit', action='store_true', help='stop the resident instance')
+    parser.add_argument('--preview', dest='preview', action='store_true', help='show a preview of the selected result (thumbnail or first lines)')
+    parser.add_argument('--stats', dest='stats', action='store_true', help='show the timings of the search stages')
+    parser.add_argument('--trace-file', dest='trace_file', metavar='FILE', help='write the timings of the search stages to FILE (JSON) on exit')
     parser.add_argument('--debug', dest='debug', action="store_const", const=True, help='enable debugging ()')
     args = parser.parse_args()
 
-    win = PyNeedle(launcher=args.launcher, terminal=args.terminal, engine=args.engine, debug=(args.debug is not None))
+    if args.quit:
+        sys.exit(0 if resident.send_command('quit') else 1)
+
+    tracer.configure(args.stats or args.trace_file is not None, debug=(args.debug is not None))
+
+    win = PyNeedle(launcher=args.launcher, terminal=args.terminal, engine=args.engine, debug=(args.debug is not None),
+                   native_roots=args.native_roots, count_limit=args.count_limit,
+                   result_limit=args.result_limit, federated_engines=args.federated_engines.split(','),
+                   stats=args.stats, resident=args.resident, scope=args.scope, recoll_confdirs=args.recoll_confdirs,
+                   preview=args.preview)
+
+    # The window, the engine connections and the caches stay warm for the next invocations
+    server = None
+    if args.resident:
+        try:
+            server = resident.ResidentServer({'present': win.present_search, 'quit': Gtk.main_quit}, debug=(args.debug is not None))
+        except OSError as e:
+            # Another instance started at the same time got the socket first, it shows its window
+            if args.debug: print("Resident socket taken:", e)
+            sys.exit(0 if resident.send_command('present') == 'ok' else 1)
+
     win.show_all()
     GLib.threads_init()
+
     Gtk.main()
 
+    if server:
+        server.close()
+
+    if args.trace_file:
+        tracer.dump(args.trace_file)
+
 
 if __name__ == '__main__':
     main()
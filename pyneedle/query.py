@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Command line searches: `pyneedle query` runs the queries given as arguments (or read
+# from the standard input, one per line) on a pool of worker processes, each one with its
+# own engine connection, and writes the hits as JSON Lines as each query completes.
+#
+from .scope import scope_word
+import argparse, concurrent.futures, json, multiprocessing, os, sys, time
+
+# Engine of the worker process, created by _init_worker
+_engine = None
+
+def _create_engine (engine, result_limit, count_limit, native_roots, rescan_interval=0):
+    if engine == 'native':
+        from . import native_engine
+        return native_engine.NativeEngine(result_limit, None, False, roots=native_roots, count_limit=count_limit,
+                                          rescan_interval=rescan_interval)
+    elif engine == 'tracker':
+        from . import tracker_engine
+        return tracker_engine.TrackerEngine(result_limit, None, False, count_limit=count_limit)
+    else:
+        from . import recoll_engine
+        return recoll_engine._RecollCommon(recoll_engine.recoll.connect(), result_limit, False, count_limit)
+
+def _init_worker (engine, result_limit, count_limit, native_roots):
+    global _engine
+    _engine = _create_engine(engine, result_limit, count_limit, native_roots)
+
+def _run_query (query_text, fts):
+    # Runs in the workers
+    starttime = time.time()
+    hits, nres = _engine.search_sync(query_text, fts)
+    return hits, nres, time.time() - starttime
+
+def _write_result (output, query_text, future):
+    try:
+        hits, nres, duration = future.result()
+    except Exception as e:
+        output.write(json.dumps({'query': query_text, 'error': str(e)}) + '\n')
+        output.flush()
+        return
+    for rank, hit in enumerate(hits):
+        output.write(json.dumps({'query': query_text, 'rank': rank, 'url': hit.url, 'name': hit.name, 'size': hit.size,
+                                 'mtime': hit.mtime, 'mimetype': hit.mimetype}) + '\n')
+    output.write(json.dumps({'query': query_text, 'nres': nres, 'hits': len(hits), 'time': duration}) + '\n')
+    output.flush()
+
+def _queries (args):
+    if args.queries:
+        return iter(args.queries)
+    return (line.rstrip('\n') for line in sys.stdin if line.strip())
+
+def main (argv=None):
+    parser = argparse.ArgumentParser(prog='pyneedle query', description='Run searches and write their hits as JSON Lines')
+    parser.add_argument('queries', metavar='QUERY', nargs='*', help='queries (read from the standard input, one per line, when none is given)')
+    parser.add_argument('--engine', dest='engine', metavar='NAME', default='recoll', help='engine (tracker, recoll, native)')
+    parser.add_argument('--fts', dest='fts', action='store_true', help='full text search (queries are sent as is to the engine)')
+    parser.add_argument('--scope', dest='scope', metavar='DIR', action='append', help='only search files under DIR (can be repeated)')
+    parser.add_argument('--native-root', dest='native_roots', metavar='DIR', action='append', help='folder indexed by the native engine (default: home folder, can be repeated)')
+    parser.add_argument('--limit', dest='result_limit', metavar='N', type=int, default=20, help='maximum number of hits per query')
+    parser.add_argument('--count-limit', dest='count_limit', metavar='N', type=int, default=1000, help='stop counting results after N matches (0 for exact counts)')
+    parser.add_argument('--jobs', dest='jobs', metavar='N', type=int, default=os.cpu_count() or 2, help='worker processes')
+    args = parser.parse_args(argv)
+
+    if args.engine == 'native':
+        # The index is built (or brought up to date when older than the usual rescan interval)
+        # once here, not by every worker
+        from . import native_engine
+        engine = _create_engine('native', args.result_limit, args.count_limit, args.native_roots, native_engine.RESCAN_INTERVAL)
+        if not engine.wait_index(rescan=True):
+            parser.error('cannot build the native index')
+
+    scope = [scope_word(directory) for directory in args.scope or []]
+    initargs = (args.engine, args.result_limit, args.count_limit, args.native_roots)
+    pool = concurrent.futures.ProcessPoolExecutor(args.jobs, multiprocessing.get_context('spawn'), _init_worker, initargs)
+
+    # Queries are submitted as they are read, keeping a bounded number of them in flight
+    pending = {}
+    for query_text in _queries(args):
+        if len(pending) >= 4 * args.jobs:
+            done, not_done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                _write_result(sys.stdout, pending.pop(future), future)
+        pending[pool.submit(_run_query, ' '.join([query_text] + scope), args.fts)] = query_text
+
+    for future in concurrent.futures.as_completed(pending):
+        _write_result(sys.stdout, pending[future], future)
+    pool.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -25,42 +25,110 @@
 #
 from recoll import recoll
 from gi.repository import GLib
+from .tracing import tracer
+from .async_engine import AsyncEngine
+from .scope import split_scope
+from .hit import Hit
 
-import time, threading, multiprocessing
-from gi.repository import GLib
+import asyncio, threading, multiprocessing, multiprocessing.connection, os
+
+
+def _index_version (confdir=None):
+    # Xapian rewrites its version file in the index directory on every commit
+    confdir = confdir or os.environ.get('RECOLL_CONFDIR') or os.path.expanduser('~/.recoll')
+    dbdir = os.path.join(confdir, 'xapiandb')
+    version = 0
+    for name in ('', 'iamglass', 'iamchert'):
+        try:
+            version = max(version, os.stat(os.path.join(dbdir, name)).st_mtime_ns)
+        except OSError:
+            pass
+    return version
+
+
+def _hit (doc):
+    # Recoll gives every field as a string
+    return Hit(doc.url, doc.filename, int(doc.pcbytes or 0), int(doc.fmtime or doc.dmtime or 0), doc.mtype)
 
 
 class _RecollCommon:
-    def __init__(self, connection, result_limit, debug=True):
+    def __init__(self, connection, result_limit, debug=True, count_limit=0):
         # Connecto to the RECOLL session
         self._connection = connection
         self._result_limit = result_limit
         self._debug = debug
+        # Counts above this number are reported as count_limit + 1 (0 for the exact count)
+        self._count_limit = count_limit
+        self._fetch_batch = 10
+        # Key, recoll query, position and count of the last search, kept to fetch its next pages
+        self._retained = None
 
-    def _exec_query (self, query, fts):
+    def index_version (self):
+        return _index_version()
+
+    def _execute (self, query, fts):
         if self._debug: print("Query:", query)
 
-        recoll_result = []
         recoll_query = self._connection.query()
         recoll_query.sortby("fmtime", ascending=False)
-        starttime = time.time()
-        nres = recoll_query.execute(query, stemlang="english spanish") if fts else recoll_query.executesd(query)
-        endtime = time.time()
+        with tracer.span('execute'):
+            nres = recoll_query.execute(query, stemlang="english spanish") if fts else recoll_query.executesd(query)
 
-        if self._debug: print("Query", endtime - starttime)
+        return recoll_query, nres
 
-        starttime = time.time()
-        for i in range(min(nres, self._result_limit)):
-            doc = recoll_query.fetchone()
-            recoll_result.append([doc.url, doc.filename, doc.pcbytes, time.localtime(int(doc.fmtime)), doc.mtype])
-        endtime = time.time()
+    def search_sync (self, query_text, fts):
+        # Blocking search (for the command line), returns the hits and the count
+        query = self._build_fts_query(query_text) if fts else self._build_filename_query(query_text)
+        return self._exec_query(query, fts)
 
-        if self._debug: print("Fetch", endtime - starttime)
+    def _capped (self, nres):
+        if self._count_limit and nres > self._count_limit:
+            return self._count_limit + 1
+        return nres
 
-        return recoll_result, nres
+    def _exec_query (self, query, fts, cancelled=None, key=None):
+        # Returns None when cancelled() becomes true while fetching the hits. The recoll query
+        # of the searches given a key (query text and fts) is kept to read their next pages.
+        recoll_result = []
+        recoll_query, nres = self._execute(query, fts)
+
+        # Cancellable searches fetch the hits one by one, so that superseded searches are
+        # abandoned before reading the next hit
+        span = tracer.span('fetch')
+        batch = 1 if cancelled else self._fetch_batch
+        remaining = min(nres, self._result_limit)
+        while remaining > 0:
+            if cancelled and cancelled():
+                if self._debug: print("Fetch abandoned after", len(recoll_result), "hits")
+                return None
+            docs = recoll_query.fetchmany(min(batch, remaining))
+            if not docs:
+                break
+            recoll_result.extend(_hit(doc) for doc in docs)
+            remaining -= len(docs)
+        span.end()
+
+        self._retained = (key, recoll_query, len(recoll_result), nres) if key else None
+        return recoll_result, self._capped(nres)
+
+    def _fetch_page (self, query_text, fts, offset, count):
+        # Continue reading the retained recoll query when the page follows the rows already read
+        retained = self._retained
+        if retained and retained[0] == (query_text, fts) and retained[2] == offset:
+            recoll_query, nres = retained[1], retained[3]
+        else:
+            query = self._build_fts_query(query_text) if fts else self._build_filename_query(query_text)
+            recoll_query, nres = self._execute(query, fts)
+            if 0 < offset < nres:
+                recoll_query.scroll(offset, mode='absolute')
+
+        docs = recoll_query.fetchmany(count) if offset < nres else []
+        self._retained = ((query_text, fts), recoll_query, offset + len(docs), nres)
+        return [_hit(doc) for doc in docs], self._capped(nres)
 
     def _build_filename_query (self, query_entry):
-        # Split query text into words
+        # Split query text into scope and words
+        dirs, query_entry = split_scope(query_entry)
         words = query_entry.split(' ')
 
         search_data = recoll.SearchData()
@@ -69,109 +137,480 @@ class _RecollCommon:
             if word != "":
                 search_data.addclause(type="filename",  qstring=word.lower())
 
+        # The scope is a dir: filter of the index, files under any of the folders
+        if len(dirs) == 1:
+            search_data.addclause(type="path", qstring=dirs[0])
+        elif dirs:
+            scope_data = recoll.SearchData(type="or")
+            for directory in dirs:
+                scope_data.addclause(type="path", qstring=directory)
+            search_data.addclause(type="sub", subSearch=scope_data)
+
         # Return query
         return search_data
 
     def _build_fts_query (self, query_entry):
-        # Get query text
+        # Get query text, the scope is given with the dir: clauses of the query language
+        dirs, query_entry = split_scope(query_entry)
+        if dirs:
+            query_entry = '(' + ' OR '.join('dir:"' + directory + '"' for directory in dirs) + ') ' + query_entry
         return query_entry
 
 
-class SearchThread(threading.Thread, _RecollCommon):
-    def __init__(self, query_text, fts, connection, result_limit, results_ready_cb, debug):
-        _RecollCommon.__init__(self, connection, result_limit, debug)
-        threading.Thread.__init__(self)
-        self._query_text = query_text
-        self._fts = fts
-        self._results_ready_cb = results_ready_cb
-        self._sem = threading.Semaphore(0)
-        self._queue = multiprocessing.Queue()
-        self._process = multiprocessing.Process(target=self._process, args=(self._queue,))
-
-    def run(self):
-        self._process.start()
-        self._sem.release()
-        result = self._queue.get()
-        self._sem.release()
-
-        if result is not None:
-            self._results_ready_cb(result[0], result[1])
-        elif self._debug:
-            print("Search cancelled")
-
-    def _process(self, queue):
-        query = self._build_fts_query(self._query_text) if self._fts else self._build_filename_query(self._query_text)
-        result = self._exec_query(query, self._fts)
-        queue.put(result)
+def _search_worker (conn, result_limit, debug, count_limit, confdir=None):
+    # Runs in a worker process with its own connection to the RECOLL session (of the index
+    # configured in confdir, the default one when None). Requests are ('search', generation,
+    # query_text, fts) and ('page', generation, query_text, fts, offset, count) messages,
+    # and any message arriving while fetching means that the running search was superseded.
+    # Every request is answered, with no hits when it failed.
+    connection = recoll.connect(confdir=confdir) if confdir else recoll.connect()
+    engine = _RecollCommon(connection, result_limit, debug, count_limit)
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+
+        if message[0] == 'quit':
+            break
+        # Cancellations of searches that already finished
+        if message[0] not in ('search', 'page'):
+            continue
+
+        try:
+            answer = _answer_request(engine, conn, message)
+        except Exception as e:
+            print("Recoll search failed:", e)
+            answer = ('result', message[1], [], 0) if message[0] == 'search' else ('page', message[1], [], 0, message[4])
+        try:
+            conn.send(answer)
+        except OSError:
+            break
+
+def _answer_request (engine, conn, message):
+    if message[0] == 'page':
+        generation, query_text, fts, offset, count = message[1:]
+        result = engine._fetch_page(query_text, fts, offset, count)
+        return ('page', generation, result[0], result[1], offset)
+
+    generation, query_text, fts = message[1:]
+    with tracer.span('build'):
+        query = engine._build_fts_query(query_text) if fts else engine._build_filename_query(query_text)
+    result = engine._exec_query(query, fts, conn.poll, (query_text, fts))
+    if result is None:
+        return ('cancelled', generation)
+    return ('result', generation, result[0], result[1])
+
+
+_MAX_FAILURES = 3
+
+class _Worker:
+    def __init__(self, context, result_limit, debug, count_limit, confdir=None, target=_search_worker):
+        self._args = (context, result_limit, debug, count_limit, confdir, target)
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=target, args=(child_conn, result_limit, debug, count_limit, confdir), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.confdir = confdir
+        # Generation of the search being run (None when idle), and the request sent for it
+        self.generation = None
+        self.request = None
+        # Time spent by the worker on the search, as seen from the window process
+        self.span = None
+        self.dead = False
+        # Workers dying again and again without answering (e.g. at start) are not replaced
+        self.answered = False
+        self.failures = 0
+
+    def send (self, message):
+        # False when the worker is gone, the reader thread starts another one
+        try:
+            self.conn.send(message)
+            return True
+        except OSError:
+            self.dead = True
+            return False
+
+    def restart (self):
+        # None when the previous workers kept dying without answering
+        failures = 0 if self.answered else self.failures + 1
+        if failures >= _MAX_FAILURES:
+            return None
+        worker = _Worker(*self._args)
+        worker.failures = failures
+        return worker
+
+
+def _close_workers (workers, reader):
+    # Workers quit once their current search is abandoned, and the reader thread when every
+    # worker is gone. They are joined on a thread of their own not to block the window.
+    for worker in workers:
+        worker.send(('quit',))
+
+    def join ():
+        for worker in workers:
+            worker.process.join(5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+        reader.join()
+    threading.Thread(target=join, daemon=True).start()
 
-    def stop(self):
-        self._sem.acquire()
-        self._queue.put(None)
-        self._sem.acquire()
-        self._process.terminate()
-        self._sem.release()
 
 class RecollEngineMP():
-    def __init__(self, result_limit, results_ready_cb=None, debug=True):
-        # Connecto to the RECOLL session
-        self._connection = recoll.connect()
+    # Searches are run by a pool of long-lived worker processes started once. Superseded
+    # searches are abandoned by the workers instead of being killed. The worker function can
+    # be replaced (the benchmark runs them on a fake recoll).
+    def __init__(self, result_limit, results_ready_cb=None, debug=True, count_limit=0, workers=2, worker=_search_worker):
         self._result_limit = result_limit
+        self._count_limit = count_limit
         self._debug = debug
         self._results_ready_cb = results_ready_cb
-        self._thread = None
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._queued = None
+        self._queued_page = None
+        self._closed = False
         self.name = 'Recoll Multiprocess'
 
-    def do_search (self, query_text, fts):
-        if self._thread:
-            self._thread.stop()
-            self._thread.join()
-
-        self._thread = SearchThread(query_text, fts, self._connection, self._result_limit, self._results_ready_cb, self._debug)
-        self._thread.start()
-
+        # Workers are spawned so that they do not inherit the GTK state nor the threads
+        context = multiprocessing.get_context('spawn')
+        self._workers = [_Worker(context, result_limit, debug, count_limit, target=worker) for i in range(workers)]
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._reader.start()
 
-class RecollEngineSP(_RecollCommon):
-    def __init__(self, result_limit, results_ready_cb=None, debug=True):
-        _RecollCommon.__init__(self, recoll.connect(), result_limit, debug)
-        self._query_timer = None
+    def do_search (self, query_text, fts):
+        with self._lock:
+            self._generation += 1
+            self._cancel_running()
+
+            # Only the latest search waits for a worker to be available
+            self._queued = ('search', self._generation, query_text, fts)
+            self._dispatch()
+
+    def fetch_page (self, query_text, fts, offset, count):
+        with self._lock:
+            self._queued_page = ('page', self._generation, query_text, fts, offset, count)
+            self._dispatch()
+
+    def index_version (self):
+        return _index_version()
+
+    def cancel (self):
+        with self._lock:
+            self._generation += 1
+            self._queued = None
+            self._queued_page = None
+            self._cancel_running()
+
+    def close (self):
+        with self._lock:
+            self._generation += 1
+            self._queued = None
+            self._queued_page = None
+            self._closed = True
+            workers = list(self._workers)
+        _close_workers(workers, self._reader)
+
+    def _cancel_running (self):
+        for worker in self._workers:
+            if worker.generation is not None and worker.generation != self._generation:
+                worker.send(('cancel', worker.generation))
+
+    def _dispatch (self):
+        # Searches go before pages
+        for attr in ('_queued', '_queued_page'):
+            request = getattr(self, attr)
+            if request is None:
+                continue
+            worker = next((worker for worker in self._workers if worker.generation is None and not worker.dead), None)
+            if worker is None:
+                if self._debug: print("All recoll workers busy, request queued")
+                return
+            # Requests that cannot be sent stay queued for the worker replacing this one
+            if not worker.send(request):
+                continue
+            worker.generation = request[1]
+            worker.request = request
+            worker.span = tracer.span('worker') if request[0] == 'search' else None
+            setattr(self, attr, None)
+
+    def _read_results (self):
+        conns = {worker.conn: worker for worker in self._workers}
+        while conns:
+            for conn in multiprocessing.connection.wait(list(conns)):
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    conn.close()
+                    with self._lock:
+                        worker = conns.pop(conn)
+                        self._workers.remove(worker)
+                        # Workers that crashed are replaced, the request they were running is
+                        # answered with no hits
+                        lost = worker.request if worker.generation == self._generation else None
+                        replacement = None if self._closed else worker.restart()
+                        if replacement:
+                            if self._debug: print("Recoll worker exited, starting another one")
+                            self._workers.append(replacement)
+                            conns[replacement.conn] = replacement
+                            self._dispatch()
+                        elif not self._closed:
+                            print("Recoll worker keeps failing, not started again")
+                    if lost and lost[0] == 'search':
+                        self._results_ready_cb([], 0)
+                    elif lost:
+                        self._results_ready_cb([], None, offset=lost[4])
+                    continue
+
+                with self._lock:
+                    worker = conns[conn]
+                    worker.generation = None
+                    worker.request = None
+                    worker.answered = True
+                    current = message[1] == self._generation
+                    self._dispatch()
+
+                if message[0] == 'result' and current:
+                    worker.span.end()
+                    self._results_ready_cb(message[2], message[3])
+                elif message[0] == 'page' and current:
+                    self._results_ready_cb(message[2], message[3], offset=message[4])
+                elif self._debug:
+                    print("Search", message[1], "cancelled")
+
+
+class RecollEngineSharded():
+    # Searches several indexes (e.g. one per volume) at the same time, each one in a worker
+    # process of its own with its own connection, and merges their hits by modification
+    # time. Searches take as long as the slowest index, not as a combined one. The
+    # position of every index in the merged hits is kept, so that the next page continues
+    # from there.
+    def __init__(self, result_limit, results_ready_cb=None, debug=True, count_limit=0, confdirs=(), worker=_search_worker):
+        self._result_limit = result_limit
+        self._count_limit = count_limit
+        self._debug = debug
         self._results_ready_cb = results_ready_cb
-        self.name = 'Recoll'
+        self._confdirs = list(confdirs) or [None]
+        self._lock = threading.Lock()
+        self._generation = 0
+        # Answers of the workers to the running search and page request, by worker
+        self._answers = None
+        self._page = None
+        self._page_answers = None
+        # Hits of every index in the merged hits shown, and number of merged hits shown
+        self._cursors = None
+        self._shown = 0
+        self._span = None
+        self._closed = False
+        self.name = 'Recoll Sharded'
+
+        context = multiprocessing.get_context('spawn')
+        self._workers = [_Worker(context, result_limit, debug, count_limit, confdir, worker) for confdir in self._confdirs]
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._reader.start()
 
     def do_search (self, query_text, fts):
-        if (self._query_timer):
-            if self._debug: print("Timer cancelled")
-            self._query_timer.cancel()
-
-        query = self._build_fts_query(query_text) if fts else self._build_filename_query(query_text)
-
-        self._query_timer = threading.Timer(0.2, self._do_query, [query, fts])
-        self._query_timer.start()
+        # Workers busy with the previous search abandon it when the new one arrives
+        with self._lock:
+            self._generation += 1
+            self._answers = {}
+            self._page = None
+            self._cursors = None
+            self._span = tracer.span('worker')
+            for worker in self._workers:
+                worker.send(('search', self._generation, query_text, fts))
+
+    def fetch_page (self, query_text, fts, offset, count):
+        with self._lock:
+            if self._cursors is not None and offset == self._shown:
+                starts, skip = self._cursors, 0
+            else:
+                # Unknown position, the indexes are merged again from their first hit
+                starts, skip = dict.fromkeys(self._workers, 0), offset
+            self._page = (offset, count, skip, starts)
+            self._page_answers = {}
+            for worker in self._workers:
+                worker.send(('page', self._generation, query_text, fts, starts.get(worker, 0), skip + count))
+
+    def index_version (self):
+        return max(_index_version(confdir) for confdir in self._confdirs)
+
+    def cancel (self):
+        with self._lock:
+            self._generation += 1
+            self._answers = None
+            self._page = None
+            for worker in self._workers:
+                worker.send(('cancel', self._generation))
+
+    def close (self):
+        with self._lock:
+            self._generation += 1
+            self._answers = None
+            self._page = None
+            self._closed = True
+            workers = list(self._workers)
+        _close_workers(workers, self._reader)
+
+    def _capped (self, nres):
+        if self._count_limit and nres > self._count_limit:
+            return self._count_limit + 1
+        return nres
+
+    def _merge (self, answers, starts, skip, count):
+        # Hits of all the indexes newest first, the count of matches and where every index
+        # continues after them
+        tagged = sorted(((hit, worker) for worker, (rows, nres) in answers.items() for hit in rows),
+                        key=lambda item: item[0].mtime, reverse=True)[:skip + count]
+        cursors = dict(starts)
+        for hit, worker in tagged:
+            cursors[worker] = cursors.get(worker, 0) + 1
+        nres = sum(nres for rows, nres in answers.values())
+        return [hit for hit, worker in tagged[skip:]], self._capped(nres), cursors
+
+    def _complete (self):
+        # Returns the arguments of the callback once every worker answered, or None
+        if self._answers is not None and all(worker in self._answers for worker in self._workers):
+            rows, nres, self._cursors = self._merge(self._answers, {}, 0, self._result_limit)
+            self._shown = len(rows)
+            self._answers = None
+            self._span.end()
+            return (rows, nres), {}
+        if self._page is not None and all(worker in self._page_answers for worker in self._workers):
+            offset, count, skip, starts = self._page
+            rows, nres, self._cursors = self._merge(self._page_answers, starts, skip, count)
+            self._shown = offset + len(rows)
+            self._page = None
+            return (rows, nres), {'offset': offset}
+        return None
+
+    def _read_results (self):
+        conns = {worker.conn: worker for worker in self._workers}
+        while conns:
+            for conn in multiprocessing.connection.wait(list(conns)):
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    conn.close()
+                    with self._lock:
+                        worker = conns.pop(conn)
+                        index = self._workers.index(worker)
+                        replacement = None if self._closed else worker.restart()
+                        if replacement is None:
+                            # The indexes of the other workers are still searched
+                            if not self._closed: print("Recoll shard worker keeps failing, not started again")
+                            del self._workers[index]
+                        else:
+                            # Workers that crashed are replaced, their index counts as having
+                            # no hits for the running search and page
+                            if self._debug: print("Recoll shard worker exited, starting another one")
+                            self._workers[index] = replacement
+                            conns[replacement.conn] = replacement
+                            if self._answers is not None:
+                                self._answers[replacement] = ([], 0)
+                            if self._page is not None:
+                                self._page_answers[replacement] = ([], 0)
+                        answer = None if self._closed else self._complete()
+                else:
+                    with self._lock:
+                        worker = conns[conn]
+                        worker.answered = True
+                        if message[1] != self._generation:
+                            if self._debug: print("Search", message[1], "superseded in", worker.confdir or "the default index")
+                            continue
+                        if message[0] == 'result' and self._answers is not None:
+                            self._answers[worker] = (message[2], message[3])
+                        elif message[0] == 'page' and self._page is not None:
+                            self._page_answers[worker] = (message[2], message[3])
+                        answer = self._complete()
+
+                if answer is not None:
+                    self._results_ready_cb(*answer[0], **answer[1])
+
+
+class RecollEngineSP(AsyncEngine, _RecollCommon):
+    # Searches are coroutines on the shared event loop, and the blocking recoll calls run
+    # on a single thread owned by the engine. Superseded searches stop before the next hit.
+    def __init__(self, result_limit, results_ready_cb=None, debug=True, count_limit=0, delay=0):
+        _RecollCommon.__init__(self, recoll.connect(), result_limit, debug, count_limit)
+        AsyncEngine.__init__(self, result_limit, results_ready_cb, debug)
+        # Debouncing is done by the window scheduler, searches start right away by default
+        self._delay = delay
+        self.name = 'Recoll'
 
-    def _do_query(self, query, fts):
-        result = self._exec_query(query, fts)
-        self._results_ready_cb(result[0], result[1])
+    async def search (self, query_text, fts):
+        if self._delay:
+            await asyncio.sleep(self._delay)
+
+        with tracer.span('build'):
+            query = self._build_fts_query(query_text) if fts else self._build_filename_query(query_text)
+        recoll_query, nres = await self.run_blocking(self._execute, query, fts)
+
+        # Hits are read one by one, every read giving a chance to cancel the search, and
+        # streamed in batches
+        span = tracer.span('fetch')
+        read = 0
+        batch = []
+        remaining = min(nres, self._result_limit)
+        while remaining > 0:
+            docs = await self.run_blocking(recoll_query.fetchmany, 1)
+            if not docs:
+                break
+            read += 1
+            remaining -= 1
+            batch.append(_hit(docs[0]))
+            if len(batch) == self._fetch_batch:
+                yield batch, None
+                batch = []
+        if batch:
+            yield batch, None
+        span.end()
+
+        self._retained = ((query_text, fts), recoll_query, read, nres)
+        yield [], self._capped(nres)
+
+    async def page (self, query_text, fts, offset, count):
+        return await self.run_blocking(self._fetch_page, query_text, fts, offset, count)
 
 class RecollEngineNT(_RecollCommon):
-    def __init__(self, result_limit, results_ready_cb=None, debug=True):
-        _RecollCommon.__init__(self, recoll.connect(), result_limit, debug)
+    def __init__(self, result_limit, results_ready_cb=None, debug=True, count_limit=0, delay=0):
+        _RecollCommon.__init__(self, recoll.connect(), result_limit, debug, count_limit)
+        # Debouncing is done by the window scheduler, searches start right away by default
+        self._delay = delay
         self._results_ready_cb = results_ready_cb
         self.name = 'Recoll No Thread'
         self._tag = None
+        # Pages queued in the main loop for a search that was superseded are not read
+        self._generation = 0
 
     def do_search (self, query_text, fts):
+        self.cancel()
+
+        with tracer.span('build'):
+            query = self._build_fts_query(query_text) if fts else self._build_filename_query(query_text)
+
+        self._tag = GLib.timeout_add(int(self._delay * 1000), self._do_query, query, fts, (query_text, fts), self._generation)
+
+    def fetch_page (self, query_text, fts, offset, count):
+        GLib.idle_add(self._do_page, query_text, fts, offset, count, self._generation)
+
+    def cancel (self):
+        self._generation += 1
         if (self._tag):
             if self._debug: print("Timer cancelled (should be)")
             GLib.source_remove(self._tag)
             self._tag = None
 
-        query = self._build_fts_query(query_text) if fts else self._build_filename_query(query_text)
-
-        self._query = query
-        self._fts = fts
-        self._tag = GLib.timeout_add(200, self._do_query)
-
-    def _do_query(self):
-        result = self._exec_query(self._query, self._fts)
-        self._results_ready_cb(result[0], result[1])
+    def _do_query(self, query, fts, key, generation):
         self._tag = None
+        if generation == self._generation:
+            result = self._exec_query(query, fts, key=key)
+            self._results_ready_cb(result[0], result[1])
+        return False
+
+    def _do_page(self, query_text, fts, offset, count, generation):
+        if generation == self._generation:
+            result = self._fetch_page(query_text, fts, offset, count)
+            self._results_ready_cb(result[0], result[1], offset=offset)
         return False
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+from .hit import apply_changes
+from .layer import EngineLayer
+from .scope import split_scope, in_scope, is_narrower
+
+def query_words (query_text):
+    # Filename queries are contains(word1) and contains(word2)..., case insensitive
+    # (the scope words are not part of the names)
+    return tuple(word.lower() for word in split_scope(query_text)[1].split(' ') if word != '')
+
+def is_refinement (words, base_words):
+    # Every name matching 'words' also matches 'base_words' when each base word
+    # is contained in some of the new words
+    return all(any(base_word in word for word in words) for base_word in base_words)
+
+def matches (filename, words):
+    name = filename.lower()
+    return all(word in name for word in words)
+
+class QueryRefiner(EngineLayer):
+    def __init__(self, engine_factory, results_ready_cb=None, debug=True):
+        EngineLayer.__init__(self, engine_factory, results_ready_cb, debug)
+
+        # Words, scope, results and index version of the last complete filename search
+        self._base_words = None
+        self._base_dirs = None
+        self._base_result = None
+        self._base_version = None
+
+    def do_search (self, query_text, fts):
+        words = query_words(query_text)
+        dirs = split_scope(query_text)[0]
+        refined = None if fts else self._refine(words, dirs)
+
+        if refined is None:
+            self._forward(query_text, fts, (words, dirs, fts, self.index_version()))
+            return
+
+        if self._debug: print("Refined", self._base_words, "->", words, "locally:", len(refined), "results")
+        self._answer(refined, len(refined))
+
+    def can_answer (self, query_text, fts):
+        return not fts and self._refine(query_words(query_text), split_scope(query_text)[0]) is not None
+
+    def files_changed (self, removed, updated):
+        with self._lock:
+            if self._base_result is not None:
+                self._base_result = apply_changes(self._base_result, removed, updated)
+        EngineLayer.files_changed(self, removed, updated)
+
+    def _refine (self, words, dirs):
+        with self._lock:
+            if (self._base_words is None or not words or self._base_version != self.index_version() or
+                    not is_refinement(words, self._base_words) or not is_narrower(dirs, self._base_dirs)):
+                return None
+            return [hit for hit in self._base_result if matches(hit.name, words) and in_scope(hit.url, dirs)]
+
+    def _results_ready (self, key, result, nres):
+        words, dirs, fts, version = key
+
+        # Only a set that was not truncated by the result limit can be refined
+        if not fts and words and len(result) >= nres:
+            with self._lock:
+                self._base_words = words
+                self._base_dirs = dirs
+                self._base_result = list(result)
+                self._base_version = version
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Resident mode: the first `pyneedle --resident` keeps running in the background with its
+# window, engine and caches ready, and the next invocations just ask it (over a local
+# socket) to show the window again. This module is the entry point and does not import
+# GTK, so that those invocations return as soon as the window is shown.
+#
+import os, socket, sys, tempfile
+
+def socket_path ():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(runtime_dir, 'pyneedle-' + str(os.getuid()) + '.sock')
+
+def send_command (command, path=None, timeout=2.0):
+    # Returns the answer of the resident instance, or None when there is none
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(path or socket_path())
+        client.sendall(command.encode('utf-8') + b'\n')
+        return client.recv(64).decode('utf-8').strip()
+    except OSError:
+        return None
+    finally:
+        client.close()
+
+class ResidentServer:
+    # Listens for the commands of later invocations ('present' and 'quit') from the GLib
+    # main loop, so that the handlers run in the GTK thread
+    def __init__(self, handlers, path=None, debug=False):
+        from gi.repository import GLib
+        self._handlers = handlers
+        self._debug = debug
+        self._path = path or socket_path()
+
+        # A socket left behind by an instance that crashed is replaced
+        if os.path.exists(self._path) and send_command('ping', self._path) is None:
+            os.unlink(self._path)
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self._path)
+        os.chmod(self._path, 0o600)
+        self._socket.listen(4)
+        self._tag = GLib.io_add_watch(self._socket.fileno(), GLib.PRIORITY_HIGH, GLib.IO_IN, self._on_connection)
+
+    def close (self):
+        from gi.repository import GLib
+        GLib.source_remove(self._tag)
+        self._socket.close()
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+    def _on_connection (self, fd, condition):
+        client, address = self._socket.accept()
+        try:
+            client.settimeout(2.0)
+            command = client.makefile('rb').readline().decode('utf-8').strip()
+            if self._debug: print("Resident command", command)
+            handler = self._handlers.get(command)
+            if handler:
+                handler()
+            client.sendall(b'ok\n' if handler or command == 'ping' else b'unknown\n')
+        except OSError as e:
+            if self._debug: print("Resident connection failed:", e)
+        finally:
+            client.close()
+        return True
+
+def main():
+    # Command line searches do not need the window at all
+    if sys.argv[1:2] == ['query']:
+        from .query import main as query_main
+        query_main(sys.argv[2:])
+        return
+
+    # Only the window options know about the resident instance, so just the two flags are
+    # looked up here before paying for GTK
+    if '--quit' in sys.argv[1:]:
+        sys.exit(0 if send_command('quit') else 1)
+    if '--resident' in sys.argv[1:] and send_command('present') == 'ok':
+        return
+
+    from .pyneedle import main as window_main
+    window_main()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+from .hit import apply_changes
+from .layer import EngineLayer
+from .refine import query_words
+from .scope import split_scope
+import collections, threading, time
+
+def normalize_query (query_text, fts):
+    # FTS queries are sent as is, filename queries do not depend on word order
+    if fts:
+        return query_text.strip()
+    return ' '.join(sorted(set(query_words(query_text))) + ['in:' + directory for directory in split_scope(query_text)[0]])
+
+class ResultCache:
+    # LRU of search results shared by all the engines of a window
+    def __init__(self, max_entries=128, max_age=300):
+        self._max_entries = max_entries
+        self._max_age = max_age
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get (self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, nres, entry_version, timestamp = entry
+                if entry_version == version and time.time() - timestamp < self._max_age:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result, nres
+
+                # Stale: the index changed or the entry is too old
+                del self._entries[key]
+
+            self.misses += 1
+            return None
+
+    def contains (self, key, version):
+        # Like get, without touching the LRU order nor the statistics
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[2] == version and time.time() - entry[3] < self._max_age
+
+    def put (self, key, version, result, nres):
+        with self._lock:
+            self._entries[key] = (list(result), nres, version, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def clear (self):
+        with self._lock:
+            self._entries.clear()
+
+    def apply_changes (self, removed, updated):
+        # Cached results are patched rather than dropped, keeping their place in the LRU
+        with self._lock:
+            for key, (result, nres, version, timestamp) in list(self._entries.items()):
+                changed = apply_changes(result, removed, updated)
+                nres = max(nres - (len(result) - len(changed)), len(changed))
+                self._entries[key] = (changed, nres, version, timestamp)
+
+class CachingEngine(EngineLayer):
+    def __init__(self, engine_factory, cache, result_limit, results_ready_cb=None, debug=True):
+        EngineLayer.__init__(self, engine_factory, results_ready_cb, debug)
+        self._cache = cache
+        self._result_limit = result_limit
+
+    def can_answer (self, query_text, fts):
+        return (self._cache.contains(self._key(query_text, fts), self.index_version()) or
+                EngineLayer.can_answer(self, query_text, fts))
+
+    def files_changed (self, removed, updated):
+        self._cache.apply_changes(removed, updated)
+        EngineLayer.files_changed(self, removed, updated)
+
+    def _key (self, query_text, fts):
+        return (self.name, normalize_query(query_text, fts), fts, self._result_limit)
+
+    def do_search (self, query_text, fts):
+        key = self._key(query_text, fts)
+        version = self.index_version()
+        cached = self._cache.get(key, version)
+
+        if cached is None:
+            self._forward(query_text, fts, (key, version))
+            return
+
+        if self._debug: print("Cache hit for", key, "hits", self._cache.hits, "misses", self._cache.misses)
+        self._answer(cached[0], cached[1])
+
+    def _results_ready (self, key, result, nres):
+        self._cache.put(key[0], key[1], result, nres)
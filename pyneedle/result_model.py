@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+from gi.repository import Gtk, GdkPixbuf, GObject
+
+class ResultModel(GObject.Object, Gtk.TreeModel):
+    # List model holding the search hits, keyed by URL (hit.url). Rows are only formatted
+    # (by format_row, returning name, url, size, date, icon and tooltip) when the view asks
+    # for them, and new result sets are applied as a diff so that unchanged rows keep
+    # their selection and do not need to be laid out again.
+    column_types = (str, str, str, str, GdkPixbuf.Pixbuf, str)
+
+    def __init__(self, format_row):
+        GObject.Object.__init__(self)
+        self._format_row = format_row
+        self._rows = []
+        self._urls = set()
+        self._formatted = {}
+
+    def __len__ (self):
+        return len(self._rows)
+
+    def get_hit (self, treeiter):
+        return self._rows[treeiter.user_data]
+
+    def get_hits (self):
+        return list(self._rows)
+
+    def get_hits_around (self, treeiter, count):
+        # Hits of the rows next to the given one, nearest first
+        i = treeiter.user_data
+        hits = []
+        for distance in range(1, count + 1):
+            for j in (i + distance, i - distance):
+                if 0 <= j < len(self._rows):
+                    hits.append(self._rows[j])
+        return hits
+
+    def clear (self):
+        self.set_rows([])
+
+    def set_rows (self, hits):
+        # Duplicated URLs are only shown once
+        hits = list(self._unique(hits))
+        new_urls = set(hit.url for hit in hits)
+
+        # Remove the rows that are not part of the new result
+        for i in reversed(range(len(self._rows))):
+            if self._rows[i].url not in new_urls:
+                self._remove(i)
+
+        # Walk the new result, keeping rows already in place and inserting (or moving) the rest
+        for i, hit in enumerate(hits):
+            url = hit.url
+            if i < len(self._rows) and self._rows[i].url == url:
+                self._update(i, hit)
+                continue
+            if url in self._urls:
+                # Moved row (e.g. a file modified since the previous search)
+                self._remove(self._find(url, i + 1))
+            self._insert(i, hit)
+
+    def append_rows (self, hits):
+        for hit in self._unique(hits, self._urls):
+            self._insert(len(self._rows), hit)
+
+    def _unique (self, hits, present=()):
+        seen = set(present)
+        for hit in hits:
+            if hit.url not in seen:
+                seen.add(hit.url)
+                yield hit
+
+    def _find (self, url, start):
+        for i in range(start, len(self._rows)):
+            if self._rows[i].url == url:
+                return i
+
+    def _remove (self, i):
+        url = self._rows.pop(i).url
+        self._urls.discard(url)
+        self._formatted.pop(url, None)
+        self.row_deleted(Gtk.TreePath([i]))
+
+    def _insert (self, i, hit):
+        self._rows.insert(i, hit)
+        self._urls.add(hit.url)
+        self.row_inserted(Gtk.TreePath([i]), self._make_iter(i))
+
+    def _update (self, i, hit):
+        old = self._rows[i]
+        self._rows[i] = hit
+        if old is not hit and old != hit:
+            self._formatted.pop(hit.url, None)
+            self.row_changed(Gtk.TreePath([i]), self._make_iter(i))
+
+    def _make_iter (self, i):
+        treeiter = Gtk.TreeIter()
+        treeiter.user_data = i
+        return treeiter
+
+    ##############################
+    # Gtk.TreeModel implementation
+    ##############################
+
+    def do_get_flags (self):
+        return Gtk.TreeModelFlags.LIST_ONLY
+
+    def do_get_n_columns (self):
+        return len(self.column_types)
+
+    def do_get_column_type (self, column):
+        return self.column_types[column]
+
+    def do_get_iter (self, path):
+        i = path.get_indices()[0]
+        if i < len(self._rows):
+            return (True, self._make_iter(i))
+        return (False, None)
+
+    def do_get_path (self, treeiter):
+        return Gtk.TreePath([treeiter.user_data])
+
+    def do_get_value (self, treeiter, column):
+        hit = self._rows[treeiter.user_data]
+        formatted = self._formatted.get(hit.url)
+        if formatted is None:
+            formatted = self._formatted[hit.url] = self._format_row(hit)
+        return formatted[column]
+
+    def do_iter_next (self, treeiter):
+        i = treeiter.user_data + 1
+        if i < len(self._rows):
+            treeiter.user_data = i
+            return (True, treeiter)
+        return (False, None)
+
+    def do_iter_previous (self, treeiter):
+        i = treeiter.user_data - 1
+        if i >= 0:
+            treeiter.user_data = i
+            return (True, treeiter)
+        return (False, None)
+
+    def do_iter_children (self, parent):
+        if parent is None and self._rows:
+            return (True, self._make_iter(0))
+        return (False, None)
+
+    def do_iter_has_child (self, treeiter):
+        return False
+
+    def do_iter_n_children (self, treeiter):
+        return len(self._rows) if treeiter is None else 0
+
+    def do_iter_nth_child (self, parent, n):
+        if parent is None and n < len(self._rows):
+            return (True, self._make_iter(n))
+        return (False, None)
+
+    def do_iter_parent (self, child):
+        return (False, None)
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+from .layer import EngineLayer
+from .tracing import tracer
+import time
+
+class SearchScheduler(EngineLayer):
+    # Debounces the searches sent to the engine. The delay adapts to the measured engine
+    # latency and to the typing speed: searches go out at once when the engine answers
+    # faster than the user types (or when a lower layer can answer them), otherwise they
+    # wait for a pause in the typing so that a burst of keystrokes sends a single search.
+    def __init__(self, engine_factory, results_ready_cb=None, debug=True, min_latency=0.03, max_delay=0.4,
+                 initial_latency=0.2, timeout_add=None, source_remove=None):
+        EngineLayer.__init__(self, engine_factory, results_ready_cb, debug)
+        self._min_latency = min_latency
+        self._max_delay = max_delay
+        self._initial_latency = initial_latency
+
+        if timeout_add is None:
+            from gi.repository import GLib
+            timeout_add, source_remove = GLib.timeout_add, GLib.source_remove
+        self._timeout_add = timeout_add
+        self._source_remove = source_remove
+        self._tag = None
+
+        # Exponentially weighted averages of the engine latency and the keystroke interval
+        self._latency = None
+        self._interval = None
+        self._last_keystroke = None
+
+    def do_search (self, query_text, fts):
+        now = time.time()
+
+        # Long pauses are not part of the typing speed
+        if self._last_keystroke is not None and now - self._last_keystroke < 1.0:
+            self._interval = self._average(self._interval, now - self._last_keystroke)
+        self._last_keystroke = now
+
+        self._remove_timeout()
+        if self.can_answer(query_text, fts):
+            self._dispatch(query_text, fts, measured=False)
+            return
+
+        delay = self.delay()
+        if delay == 0:
+            self._dispatch(query_text, fts)
+            return
+
+        # The search running below answers an older query, its results must not go up
+        # while this one waits
+        EngineLayer.cancel(self)
+        if self._debug: print("Search delayed", int(delay * 1000), "ms")
+        self._tag = self._timeout_add(int(delay * 1000), self._on_timeout, query_text, fts, tracer.span('debounce'))
+
+    def delay (self):
+        latency = self._initial_latency if self._latency is None else self._latency
+        if latency < self._min_latency:
+            return 0
+        interval = self._max_delay if self._interval is None else self._interval
+        return min(self._max_delay, max(latency, interval * 1.5))
+
+    def cancel (self):
+        self._remove_timeout()
+        EngineLayer.cancel(self)
+
+    def _average (self, average, value, weight=0.3):
+        return value if average is None else (1 - weight) * average + weight * value
+
+    def _remove_timeout (self):
+        if self._tag is not None:
+            self._source_remove(self._tag)
+            self._tag = None
+
+    def _on_timeout (self, query_text, fts, span):
+        span.end()
+        self._tag = None
+        self._dispatch(query_text, fts)
+        return False
+
+    def _dispatch (self, query_text, fts, measured=True):
+        # Searches answered by lower layers do not say anything about the engine latency
+        self._forward(query_text, fts, (time.time(), measured))
+
+    def _results_ready (self, key, result, nres):
+        starttime, measured = key
+        if measured:
+            self._latency = self._average(self._latency, time.time() - starttime)
+            if self._debug: print("Engine latency", self._latency, "keystroke interval", self._interval)
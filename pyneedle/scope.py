@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+# Search scopes travel in the query text as 'in:DIR' words (percent-encoded, so that folders
+# with spaces fit in a word), typed by the user or added by the window for --scope. Files
+# have to be under any of the folders, and every engine turns them into a native filter.
+#
+import os, urllib.parse
+
+SCOPE_PREFIX = 'in:'
+
+def normalize_dir (directory):
+    return os.path.normpath(os.path.abspath(os.path.expanduser(directory)))
+
+def scope_word (directory):
+    return SCOPE_PREFIX + urllib.parse.quote(normalize_dir(directory))
+
+def split_scope (query_text):
+    # Returns the folders of the query and the query text without them
+    dirs = []
+    words = []
+    for word in query_text.split(' '):
+        if word.startswith(SCOPE_PREFIX):
+            # A lone 'in:' is a scope still being typed
+            if len(word) > len(SCOPE_PREFIX):
+                dirs.append(normalize_dir(urllib.parse.unquote(word[len(SCOPE_PREFIX):])))
+        else:
+            words.append(word)
+    return tuple(sorted(set(dirs))), ' '.join(words)
+
+def is_under (path, directory):
+    return path == directory or path.startswith(directory.rstrip('/') + '/')
+
+def in_scope (url, dirs):
+    if not dirs:
+        return True
+    path = urllib.parse.unquote(urllib.parse.urlparse(url).path)
+    return any(is_under(path, directory) for directory in dirs)
+
+def is_narrower (dirs, base_dirs):
+    # True when every file under 'dirs' is also under 'base_dirs'
+    if not base_dirs:
+        return True
+    return bool(dirs) and all(any(is_under(directory, base_dir) for base_dir in base_dirs) for directory in dirs)
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+import collections, json, threading, time
+
+# Upper bounds (in seconds) of the histogram buckets, the last one has no bound
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0)
+
+def percentile (values, p):
+    # Nearest rank percentile of a sorted list
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1))]
+
+def stats (values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {'count': len(values), 'mean': sum(values) / len(values),
+            'p50': percentile(values, 50), 'p95': percentile(values, 95), 'p99': percentile(values, 99),
+            'max': values[-1]}
+
+def histogram (values):
+    counts = [0] * (len(BUCKETS) + 1)
+    for value in values:
+        i = 0
+        while i < len(BUCKETS) and value > BUCKETS[i]:
+            i += 1
+        counts[i] += 1
+    return counts
+
+class _Span:
+    __slots__ = ('_tracer', 'name', 'query_id', 'start', 'duration')
+
+    def __init__(self, tracer, name, query_id):
+        self._tracer = tracer
+        self.name = name
+        self.query_id = query_id
+        self.start = time.time()
+        self.duration = None
+
+    def end (self):
+        # Only the first end counts, so spans can be ended from several code paths
+        if self.duration is None:
+            self.duration = time.time() - self.start
+            self._tracer._record(self)
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, exc_type, exc_value, traceback):
+        self.end()
+
+class _NullSpan:
+    # Returned while tracing is disabled
+    __slots__ = ()
+
+    def end (self):
+        pass
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, exc_type, exc_value, traceback):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Tracer:
+    # Times the stages of the search pipeline ('debounce', 'build', 'execute', 'fetch', 'count',
+    # 'icon', 'populate' and the whole 'search', from the keystroke to the final results shown).
+    # Spans carry the ID of the query being typed when they started, and the durations of the
+    # last spans of every stage are kept to compute rolling histograms.
+    def __init__(self, enabled=False, debug=False, history=1000, recent=200):
+        self.enabled = enabled
+        self.debug = debug
+        self.query_id = 0
+        self._history = history
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._recent = collections.deque(maxlen=recent)
+
+    def configure (self, enabled, debug=False):
+        self.enabled = enabled or debug
+        self.debug = debug
+
+    def new_query (self):
+        self.query_id += 1
+        return self.query_id
+
+    def span (self, name, query_id=None):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, self.query_id if query_id is None else query_id)
+
+    def _record (self, span):
+        if self.debug: print("Span", span.name, "query", span.query_id, span.duration)
+        with self._lock:
+            durations = self._durations.get(span.name)
+            if durations is None:
+                durations = self._durations[span.name] = collections.deque(maxlen=self._history)
+            durations.append(span.duration)
+            self._recent.append((span.query_id, span.name, span.start, span.duration))
+
+    def stats (self):
+        with self._lock:
+            durations = dict((name, list(values)) for name, values in self._durations.items())
+        return dict((name, stats(values)) for name, values in durations.items())
+
+    def report (self):
+        with self._lock:
+            durations = dict((name, list(values)) for name, values in self._durations.items())
+            recent = list(self._recent)
+        return {
+            'buckets': list(BUCKETS),
+            'spans': dict((name, dict(stats(values), histogram=histogram(values))) for name, values in durations.items()),
+            'recent': [{'query': query_id, 'span': name, 'start': start, 'duration': duration}
+                       for query_id, name, start, duration in recent],
+        }
+
+    def dump (self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+            f.write('\n')
+
+    def clear (self):
+        with self._lock:
+            self._durations.clear()
+            self._recent.clear()
+
+# Shared by every module of the process (worker processes get their own, disabled, one)
+tracer = Tracer()
@@ -23,126 +23,331 @@
 # TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
-from gi.repository import Gio, Tracker
-import time
+from gi.repository import Gio, GLib, Tracker
+from .tracing import tracer
+from .scope import split_scope
+from .hit import Hit
+import datetime
+
+def _timestamp (date_time):
+    # xsd:dateTime values come in UTC ('2013-05-02T10:20:30Z'), the offset is kept so that
+    # they are not read as local times
+    if not date_time:
+        return 0
+    return datetime.datetime.fromisoformat(date_time.replace('Z', '+00:00')).timestamp()
+
+def _cancelled (error):
+    # Operations of superseded searches end with G_IO_ERROR_CANCELLED, which is expected
+    return isinstance(error, GLib.Error) and error.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED)
+
+def _dir_url (directory):
+    # Prefix of the URLs of the files under a folder, escaped as tracker stores them
+    uri = Gio.File.new_for_path(directory).get_uri()
+    return uri if uri.endswith('/') else uri + '/'
 
 class TrackerEngine:
-    def __init__(self, result_limit=20, results_ready_cb=None, debug=True):
+    # Index changes are watched once for all the engine instances, and the URLs of the
+    # changed files are passed to the listeners
+    _notifier = None
+    _index_version = 0
+    _listeners = []
+
+    def __init__(self, result_limit=20, results_ready_cb=None, debug=True, stream_batch=5, count_limit=0):
         self._connection = Tracker.SparqlConnection.get_direct(None)
         self._result_limit = result_limit
+        # Counting stops after this number of matches (0 for an exact count)
+        self._count_limit = count_limit
+        # Rows are sent to the window in batches of this size as they arrive (0 disables it)
+        self._stream_batch = stream_batch
         self._debug = debug
         self._cancellable = Gio.Cancellable()
+        self._count_cancellable = Gio.Cancellable()
+        self._page_cancellable = Gio.Cancellable()
+        # Count of the running or last search, and its (query text, fts)
+        self._count = None
+        self._count_key = None
         self._results_ready_cb = results_ready_cb
         self.name = 'Tracker async'
+        # Prepared statements, by (query kind, number of words, number of scope folders)
+        self._statements = {}
+        self._watch_index()
+
+    def _watch_index (self):
+        if TrackerEngine._notifier is not None:
+            return
+
+        try:
+            if hasattr(self._connection, 'create_notifier'):
+                notifier = self._connection.create_notifier()
+            else:
+                notifier = Tracker.Notifier.new(['nfo:FileDataObject'], Tracker.NotifierFlags.QUERY_LOCATION, None)
+            notifier.connect('events', TrackerEngine._on_index_events)
+            TrackerEngine._notifier = notifier
+        except Exception as e:
+            if self._debug:
+                print("Cannot watch tracker index changes:", e)
+
+    @staticmethod
+    def add_change_listener (callback):
+        if callback not in TrackerEngine._listeners:
+            TrackerEngine._listeners.append(callback)
+
+    @staticmethod
+    def _on_index_events (notifier, *args):
+        TrackerEngine._index_version += 1
+
+        # Events are the last argument (after the service and graph names in Tracker 3, where
+        # the URN of a file is its URL)
+        for event in args[-1]:
+            url = event.get_location() if hasattr(event, 'get_location') else event.get_urn()
+            if url:
+                for callback in TrackerEngine._listeners:
+                    callback(url)
+
+    def index_version (self):
+        return TrackerEngine._index_version
 
     def do_search (self, query_text, fts):
-        self._cancellable.cancel()
+        self.cancel()
         self._cancellable = Gio.Cancellable()
-        query = self._build_fts_query(query_text) if fts else self._build_filename_query(query_text)
-        self._count_query = self._build_fts_count_query(query_text) if fts else self._build_filename_count_query(query_text)
-        self._starttime = time.time()
+        self._count_cancellable = Gio.Cancellable()
+        self._tracker_result = None
+        self._count = None
+        self._count_key = (query_text, fts)
+
+        # Search terms are bound as parameters of statements prepared once per query shape
+        with tracer.span('build'):
+            terms, dirs = self._terms(query_text, fts)
+            if fts:
+                query = self._get_statement('fts', 1, len(dirs), self._build_fts_query)
+                count_query = self._get_statement('fts_count', 1, len(dirs), self._build_fts_count_query)
+            else:
+                query = self._get_statement('filename', len(terms), len(dirs), self._build_filename_query)
+                count_query = self._get_statement('filename_count', len(terms), len(dirs), self._build_filename_count_query)
+            self._bind(query, terms, dirs)
+            self._bind(count_query, terms, dirs)
+        if self._debug:
+            print("Search terms", terms, "in", dirs)
+
+        # Results and count are computed concurrently
         self._exec_query_async(query)
+        self._exec_query_count_async(count_query)
+
+    def search_sync (self, query_text, fts):
+        # Blocking search (for the command line), returns the rows and the count
+        terms, dirs = self._terms(query_text, fts)
+        nterms = 1 if fts else len(terms)
+        if fts:
+            query = self._get_statement('fts', nterms, len(dirs), self._build_fts_query)
+            count_query = self._get_statement('fts_count', nterms, len(dirs), self._build_fts_count_query)
+        else:
+            query = self._get_statement('filename', nterms, len(dirs), self._build_filename_query)
+            count_query = self._get_statement('filename_count', nterms, len(dirs), self._build_filename_count_query)
+        self._bind(query, terms, dirs)
+
+        rows = []
+        cursor = query.execute(None)
+        while cursor.next(None):
+            rows.append(self._read_row(cursor))
+        if len(rows) < self._result_limit:
+            return rows, len(rows)
+
+        self._bind(count_query, terms, dirs)
+        cursor = count_query.execute(None)
+        return rows, int(cursor.get_string(0)[0]) if cursor.next(None) else len(rows)
+
+    def fetch_page (self, query_text, fts, offset, count):
+        # Pages are read with their own statements (bound to an offset) and cancellable
+        self._page_cancellable.cancel()
+        self._page_cancellable = Gio.Cancellable()
+        terms, dirs = self._terms(query_text, fts)
+        if fts:
+            query = self._get_statement('fts_page', 1, len(dirs), self._build_fts_query)
+        else:
+            query = self._get_statement('filename_page', len(terms), len(dirs), self._build_filename_query)
+        self._bind(query, terms, dirs, count, offset)
+        query.execute_async(self._page_cancellable, self._page_statement_ready, (offset, (query_text, fts)))
 
-    def _connection_ready (self, connection, result, user_data):
+    def cancel (self):
+        self._cancellable.cancel()
+        self._count_cancellable.cancel()
+        self._page_cancellable.cancel()
+        self._count = None
+        self._count_key = None
+
+    def _terms (self, query_text, fts):
+        # Returns the search terms and the URL prefixes of the scope folders
+        dirs, query_text = split_scope(query_text)
+        dirs = [_dir_url(directory) for directory in dirs]
+        if fts:
+            return [query_text], dirs
+        return [word.lower() for word in query_text.split(' ') if word != ''], dirs
+
+    def _get_statement (self, kind, nterms, ndirs, builder):
+        statement = self._statements.get((kind, nterms, ndirs))
+        if statement is None:
+            query = builder(nterms, ndirs)
+            if self._debug:
+                print("Preparing", query)
+            statement = self._connection.query_statement(query, None)
+            self._statements[(kind, nterms, ndirs)] = statement
+        return statement
+
+    def _bind (self, statement, terms, dirs, limit=None, offset=0):
+        for i, term in enumerate(terms):
+            statement.bind_string('t' + str(i), term)
+        for i, url in enumerate(dirs):
+            statement.bind_string('d' + str(i), url)
+        statement.bind_int('limit', limit or self._result_limit)
+        statement.bind_int('offset', offset)
+        if self._count_limit:
+            statement.bind_int('countlimit', self._count_limit + 1)
+
+    def _statement_ready (self, statement, result, user_data):
         tracker_result = []
-        cursor = connection.query_finish (result)
+        try:
+            cursor = statement.execute_finish (result)
+        except Exception as e:
+            if self._debug and not _cancelled(e):
+                print(e)
+            return
+        self._execute_span.end()
+        self._fetch_span = tracer.span('fetch')
         cursor.next_async(self._cancellable, self._cursor_ready, tracker_result)
 
     def _cursor_ready (self, cursor, result, tracker_result):
         try:
             if cursor.next_finish(result):
-                tracker_result.append([cursor.get_string(0)[0], cursor.get_string(1)[0], cursor.get_string(2)[0], time.strptime(cursor.get_string(3)[0], '%Y-%m-%dT%H:%M:%SZ'), cursor.get_string(4)[0]])
+                tracker_result.append(self._read_row(cursor))
+                if self._stream_batch and len(tracker_result) % self._stream_batch == 0:
+                    self._results_ready_cb(tracker_result[-self._stream_batch:], None, partial=True)
                 cursor.next_async(self._cancellable, self._cursor_ready, tracker_result)
             else:
+                # Stream the last incomplete batch, the count comes with the final results
+                if self._stream_batch and len(tracker_result) % self._stream_batch:
+                    self._results_ready_cb(tracker_result[-(len(tracker_result) % self._stream_batch):], None, partial=True)
                 self._tracker_result = tracker_result
-                self._exec_query_count_async(self._count_query)
+                self._fetch_span.end()
+
+                # When the result limit was not reached the rows are the whole count
+                if len(tracker_result) < self._result_limit and self._count is None:
+                    self._count_cancellable.cancel()
+                    self._count = len(tracker_result)
+                self._search_done()
         except Exception as e:
-            if self._debug:
+            if self._debug and not _cancelled(e):
                 print(e)
 
-    def _exec_query_async (self, query):
-        if self._debug:
-            print(query)
-        self._connection.query_async(query, self._cancellable, self._connection_ready, None)
+    def _read_row (self, cursor):
+        return Hit(cursor.get_string(0)[0], cursor.get_string(1)[0], cursor.get_integer(2), _timestamp(cursor.get_string(3)[0]), cursor.get_string(4)[0])
+
+    def _page_statement_ready (self, statement, result, page):
+        offset, key = page
+        try:
+            cursor = statement.execute_finish (result)
+            cursor.next_async(self._page_cancellable, self._page_cursor_ready, (offset, key, []))
+        except Exception as e:
+            if self._debug and not _cancelled(e):
+                print(e)
+
+    def _page_cursor_ready (self, cursor, result, page):
+        offset, key, rows = page
+        try:
+            if cursor.next_finish(result):
+                rows.append(self._read_row(cursor))
+                cursor.next_async(self._page_cancellable, self._page_cursor_ready, page)
+            else:
+                # The count is unknown when it was not computed for this query (e.g. searches
+                # answered by the cache)
+                self._results_ready_cb(rows, self._count if key == self._count_key else None, offset=offset)
+        except Exception as e:
+            if self._debug and not _cancelled(e):
+                print(e)
 
-    def _connection_ready_count (self, connection, result, user_data):
-        cursor = connection.query_finish (result)
-        cursor.next_async(self._cancellable, self._cursor_ready_count, None)
+    def _exec_query_async (self, statement):
+        self._execute_span = tracer.span('execute')
+        statement.execute_async(self._cancellable, self._statement_ready, None)
+
+    def _statement_ready_count (self, statement, result, user_data):
+        try:
+            cursor = statement.execute_finish (result)
+        except Exception as e:
+            if self._debug and not _cancelled(e):
+                print(e)
+            return
+        cursor.next_async(self._count_cancellable, self._cursor_ready_count, None)
 
     def _cursor_ready_count (self, cursor, result, user_data):
         try:
             if (cursor.next_finish(result)):
-                self._results_ready_cb(self._tracker_result, int(cursor.get_string(0)[0]))
-                endtime = time.time()
-
-                if self._debug:
-                    print("Query", endtime - self._starttime)
-                    starttime = time.time()
+                self._count = int(cursor.get_string(0)[0])
+                self._count_span.end()
+                self._search_done()
 
         except Exception as e:
-            if self._debug:
+            if self._debug and not _cancelled(e):
                 print(e)
 
-    def _exec_query_count_async (self, query):
-        if self._debug:
-            print(query)
-        self._connection.query_async(query, self._cancellable, self._connection_ready_count, None)
+    def _search_done (self):
+        # Called when either the results or the count are ready
+        if self._tracker_result is None or self._count is None:
+            return
 
-    def _build_filename_count_query (self, query_entry):
-        # Split query text into words
-        words = query_entry.split(' ')
+        self._results_ready_cb(self._tracker_result, self._count)
 
-        # Create filter for every one of those words
-        queryfilter = 'FILTER (fn:contains (fn:lower-case(?name), \'' + words[0].lower() + '\')'
+    def _exec_query_count_async (self, statement):
+        self._count_span = tracer.span('count')
+        statement.execute_async(self._count_cancellable, self._statement_ready_count, None)
 
-        for word in words[1:]:
-            queryfilter += ' && fn:contains(fn:lower-case(?name), \'' + word.lower() + '\')'
-        queryfilter += ' )'
+    def _build_filename_filter (self, nterms):
+        # Create filter for every one of the words (~t0, ~t1...)
+        if nterms == 0:
+            return ''
+        conditions = ['fn:contains(fn:lower-case(?name), ~t' + str(i) + ')' for i in range(nterms)]
+        return 'FILTER (' + ' && '.join(conditions) + ' )'
 
-        # Create query
-        query = ('SELECT count(?f) ' +
-                 'WHERE { ?f nfo:fileName ?name ; tracker:available true . ' + queryfilter + '  } ')
+    def _build_scope_filter (self, ndirs):
+        # Files whose URL starts with any of the folder prefixes (~d0, ~d1...)
+        if ndirs == 0:
+            return ''
+        conditions = ['STRSTARTS(?url, ~d' + str(i) + ')' for i in range(ndirs)]
+        return '?f nie:url ?url . FILTER (' + ' || '.join(conditions) + ' ) '
 
-        # Return query
-        return query
+    def _build_filename_pattern (self, nterms, ndirs):
+        return '?f nfo:fileName ?name ; tracker:available true . ' + self._build_scope_filter(ndirs) + self._build_filename_filter(nterms)
 
-    def _build_fts_count_query (self, query_entry):
-        # Get query text
-        querytext = query_entry
+    def _build_fts_pattern (self, ndirs):
+        return '{?f fts:match ~t0 ; tracker:available true } ' + self._build_scope_filter(ndirs)
 
+    def _build_filename_count_query (self, nterms, ndirs):
         # Create query
-        query = ('SELECT count(?f)' +
-                 'WHERE { {?f fts:match \'' + querytext + '\' ; tracker:available true } }')
+        return self._build_count_query(self._build_filename_pattern(nterms, ndirs))
 
-        # Return query
-        return query
+    def _build_fts_count_query (self, nterms, ndirs):
+        # Create query
+        return self._build_count_query(self._build_fts_pattern(ndirs))
 
-    def _build_filename_query (self, query_entry):
-        # Split query text into words
-        words = query_entry.split(' ')
+    def _build_count_query (self, pattern):
+        if not self._count_limit:
+            return 'SELECT count(?f) WHERE { ' + pattern + ' }'
 
-        # Create filter for every one of those words
-        queryfilter = 'FILTER (fn:contains (fn:lower-case(?name), \'' + words[0].lower() + '\')'
-        for word in words[1:]:
-            queryfilter += ' && fn:contains(fn:lower-case(?name), \'' + word.lower() + '\')'
-        queryfilter += ' )'
+        # Fast count: the subquery stops matching once the limit is exceeded
+        return 'SELECT count(?f) WHERE { { SELECT ?f WHERE { ' + pattern + ' } LIMIT ~countlimit } }'
 
+    def _build_filename_query (self, nterms, ndirs):
         # Create query
         query = ('SELECT DISTINCT nie:url(?f) nfo:fileName(?f) nfo:fileSize(?f) nfo:fileLastModified(?f) nie:mimeType(?f) ' +
-                 'WHERE { ?f nfo:fileName ?name ; tracker:available true . ' + queryfilter + '  } ' +
-                 'ORDER BY DESC nfo:fileLastModified(?f) LIMIT ' + str(self._result_limit))
+                 'WHERE { ' + self._build_filename_pattern(nterms, ndirs) + '  } ' +
+                 'ORDER BY DESC nfo:fileLastModified(?f) LIMIT ~limit OFFSET ~offset')
 
         # Return query
         return query
 
-    def _build_fts_query (self, query_entry):
-        # Get query text
-        querytext = query_entry
-
+    def _build_fts_query (self, nterms, ndirs):
         # Create query
         query = ('SELECT DISTINCT nie:url(?f) nfo:fileName(?f) nfo:fileSize(?f) nfo:fileLastModified(?f) nie:mimeType(?f) ' +
-                 'WHERE { {?f fts:match \'' + querytext + '\' ; tracker:available true } }' +
-                 'ORDER BY DESC nfo:fileLastModified(?f) LIMIT ' + str(self._result_limit))
+                 'WHERE { ' + self._build_fts_pattern(ndirs) + '}' +
+                 'ORDER BY DESC nfo:fileLastModified(?f) LIMIT ~limit OFFSET ~offset')
 
         # Return query
         return query
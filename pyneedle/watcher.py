@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2013 Alejandro Pérez Méndez (alex@um.es)
+# Copyright (C) 2013 Pedro Martinez-Julia (pedromj@um.es)
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY
+# CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+# TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+from gi.repository import Gio, GLib
+from .hit import Hit
+import os
+
+class ResultWatcher:
+    # Keeps the displayed hits up to date without searching again. The folders of the hits
+    # are watched with file monitors (inotify), and other sources (the Tracker notifier) can
+    # report changed URLs with file_changed(). Changes are collected for a short delay, so
+    # that a file being written is only looked at once, and then reported with
+    # changed_cb(removed, updated, created): the set of URLs of the deleted hits, a dict
+    # with the new hits of the modified ones, and the hits of the files that were not shown.
+    def __init__(self, changed_cb, delay=300, max_dirs=256, debug=True):
+        self._changed_cb = changed_cb
+        self._delay = delay
+        # Folders watched at most, the inotify watches are a limited resource
+        self._max_dirs = max_dirs
+        self._debug = debug
+        self._hits = {}
+        self._monitors = {}
+        self._pending = set()
+        self._timer = None
+
+    def watch (self, hits):
+        # Called with the hits shown after every change of the result list. Hits are looked
+        # up by path, as engines and file monitors do not quote URLs the same way.
+        self._hits = dict((hit.path, hit) for hit in hits if hit.url.startswith('file://'))
+        dirs = {}
+        for path in self._hits:
+            dirs.setdefault(os.path.dirname(path))
+        dirs = set(list(dirs)[:self._max_dirs])
+
+        for directory in set(self._monitors) - dirs:
+            self._monitors.pop(directory).cancel()
+        for directory in dirs - set(self._monitors):
+            try:
+                monitor = Gio.File.new_for_path(directory).monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+            except GLib.Error as e:
+                if self._debug: print("Cannot watch", directory, e)
+                continue
+            monitor.connect('changed', self._on_changed)
+            self._monitors[directory] = monitor
+
+    def file_changed (self, url):
+        path = Gio.File.new_for_uri(url).get_path()
+        if path is not None:
+            self._path_changed(path)
+
+    def _path_changed (self, path):
+        self._pending.add(path)
+        if self._timer is None:
+            self._timer = GLib.timeout_add(self._delay, self._flush)
+
+    def close (self):
+        self.watch([])
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+        self._pending.clear()
+
+    def _on_changed (self, monitor, changed_file, other_file, event_type):
+        if event_type in (Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.ATTRIBUTE_CHANGED,
+                          Gio.FileMonitorEvent.DELETED, Gio.FileMonitorEvent.CREATED,
+                          Gio.FileMonitorEvent.MOVED_IN, Gio.FileMonitorEvent.MOVED_OUT,
+                          Gio.FileMonitorEvent.RENAMED):
+            self._path_changed(changed_file.get_path())
+            if other_file is not None:
+                self._path_changed(other_file.get_path())
+
+    def _flush (self):
+        self._timer = None
+        pending, self._pending = self._pending, set()
+
+        removed = set()
+        updated = {}
+        created = []
+        for path in pending:
+            hit = self._hits.get(path)
+            if hit is None and os.path.dirname(path) not in self._monitors:
+                # Files reported by the indexer far from the results are not worth a look
+                continue
+            info = self._query_info(path)
+            if info is None:
+                if hit is not None:
+                    removed.add(hit.url)
+                continue
+
+            size = 0 if info.get_file_type() == Gio.FileType.DIRECTORY else info.get_size()
+            mtime = info.get_attribute_uint64(Gio.FILE_ATTRIBUTE_TIME_MODIFIED)
+            if hit is None:
+                created.append(Hit(Gio.File.new_for_path(path).get_uri(), info.get_display_name(), size, mtime, info.get_content_type()))
+            elif hit.size != size or int(hit.mtime) != mtime:
+                updated[hit.url] = Hit(hit.url, hit.name, size, mtime, hit.mimetype)
+
+        if removed or updated or created:
+            if self._debug: print("Files changed:", len(removed), "removed", len(updated), "updated", len(created), "created")
+            self._changed_cb(removed, updated, created)
+        return False
+
+    def _query_info (self, path):
+        try:
+            return Gio.File.new_for_path(path).query_info('standard::type,standard::display-name,standard::size,standard::content-type,time::modified',
+                                                        Gio.FileQueryInfoFlags.NONE, None)
+        except GLib.Error:
+            return None
@@ -11,7 +11,8 @@ setup(name='pyneedle',
       url='https://bitbucket.org/aperezmendez/pyneedle',
       packages=['pyneedle'],
       package_dir={'pyneedle': 'pyneedle/'},
-      entry_points={'gui_scripts': ['pyneedle = pyneedle.pyneedle:main']},
+      entry_points={'gui_scripts': ['pyneedle = pyneedle.resident:main'],
+                    'console_scripts': ['pyneedle-bench = pyneedle.bench:main']},
       data_files=[
             ('share/pyneedle', ['README.md']),
             ('share/applications', ['pyneedle.desktop']),